@@ -1,15 +1,326 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from concurrent.futures import ThreadPoolExecutor
 import PyPDF2
 import docx
 import io
+import json
+import os
+import queue
+import re
+import requests
+import tempfile
+import threading
+import time
+import uuid
 
 app = Flask(__name__)
 CORS(app)
 
+# Where ingestion jobs send extracted entities and relationships
+GRAPHRAG_API_URL = os.getenv('GRAPHRAG_API_URL', 'http://graphrag-api:5005')
+INGEST_INSERT_ENDPOINT = os.getenv('INGEST_INSERT_ENDPOINT', '/graph/batch-insert-with-embeddings')
+INGEST_INSERT_TIMEOUT = float(os.getenv('INGEST_INSERT_TIMEOUT', '300'))
+INGEST_INSERT_RETRIES = int(os.getenv('INGEST_INSERT_RETRIES', '3'))
+
+# OpenAI-compatible chat completions API used to extract entities from chunks
+LLM_API_URL = os.getenv('LLM_API_URL', '')
+LLM_API_KEY = os.getenv('LLM_API_KEY', '')
+LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-5-mini')
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '120'))
+
+# Documents processed at once, and chunks extracted at once across them
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '2'))
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', '4'))
+# Chunks a job may have extracting or waiting for insert before reading pauses
+INGEST_MAX_IN_FLIGHT = int(os.getenv('INGEST_MAX_IN_FLIGHT', '16'))
+# Jobs waiting for a worker before submissions are refused with 429
+INGEST_MAX_QUEUED = int(os.getenv('INGEST_MAX_QUEUED', '20'))
+# Entities per insert request to graphrag-api
+INGEST_INSERT_BATCH = int(os.getenv('INGEST_INSERT_BATCH', '200'))
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', '2000'))
+INGEST_SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', tempfile.gettempdir())
+MAX_FINISHED_JOBS = int(os.getenv('MAX_FINISHED_JOBS', '100'))
+
+# Same prompts as the "Import Knowledge" Dify workflow
+EXTRACTION_SYSTEM_PROMPT = (
+    'You are an expert at extracting structured knowledge from text. '
+    'Extract entities (people, organizations, technologies, concepts, products, '
+    'locations) and their relationships. Be specific and accurate. Only extract '
+    'entities that are clearly mentioned in the text.'
+)
+EXTRACTION_USER_PROMPT = """Extract entities and relationships from the following text:
+
+{text}
+
+Return ONLY valid JSON with this format:
+{{
+  "entities": [{{"name": "...", "type": "...", "description": "..."}}],
+  "relationships": [{{"source": "...", "target": "...", "type": "...", "weight": 0.9}}]
+}}"""
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_queue = queue.Queue(maxsize=INGEST_MAX_QUEUED)
+_workers_started = False
+extract_executor = ThreadPoolExecutor(max_workers=EXTRACT_WORKERS, thread_name_prefix='extract')
+http = requests.Session()
+
+def iter_pages(path, kind):
+    """Yield a document's text one page (PDF) or paragraph at a time"""
+    if kind == 'pdf':
+        with open(path, 'rb') as f:
+            for page in PyPDF2.PdfReader(f).pages:
+                yield page.extract_text() or ''
+    elif kind == 'docx':
+        for para in docx.Document(path).paragraphs:
+            yield para.text
+    else:
+        # Plain text: one paragraph (blank-line separated) at a time
+        with open(path, encoding='utf-8') as f:
+            lines = []
+            for line in f:
+                if line.strip():
+                    lines.append(line)
+                elif lines:
+                    yield ''.join(lines)
+                    lines = []
+            if lines:
+                yield ''.join(lines)
+
+def iter_chunks(pages, chunk_size):
+    """Pack paragraphs into chunks of under ``chunk_size`` characters.
+
+    Same rule as the Dify workflow's "Split text into chunks" step, but
+    fed page by page so the whole document is never held in memory.
+    """
+    current = []
+    length = 0
+    for page in pages:
+        for para in page.split('\n\n'):
+            if length + len(para) < chunk_size:
+                current.append(para)
+                length += len(para) + 2
+                continue
+            chunk = '\n\n'.join(current).strip()
+            if chunk:
+                yield chunk
+            current = [para]
+            length = len(para) + 2
+    chunk = '\n\n'.join(current).strip()
+    if chunk:
+        yield chunk
+
+def extract_entities(text):
+    """Ask the LLM for the entities and relationships in one chunk"""
+    headers = {'Authorization': f'Bearer {LLM_API_KEY}'} if LLM_API_KEY else {}
+    response = http.post(f"{LLM_API_URL.rstrip('/')}/chat/completions", headers=headers, json={
+        'model': LLM_MODEL,
+        'messages': [
+            {'role': 'system', 'content': EXTRACTION_SYSTEM_PROMPT},
+            {'role': 'user', 'content': EXTRACTION_USER_PROMPT.format(text=text)}
+        ]
+    }, timeout=LLM_TIMEOUT)
+    response.raise_for_status()
+    content = response.json()['choices'][0]['message']['content']
+
+    # Clean markdown if present
+    data = json.loads(re.sub(r'```json\s*|\s*```', '', content).strip())
+    entities = [e for e in data.get('entities', []) if e.get('name')]
+    relationships = [r for r in data.get('relationships', []) if r.get('source') and r.get('target')]
+    return entities, relationships
+
+def insert_batch(entities, relationships):
+    """Send one batch to graphrag-api, retrying with backoff.
+
+    Every attempt carries the same Idempotency-Key, so a retry of a batch
+    that was committed before its response got lost is not applied twice.
+    Client errors (4xx) are not retried.
+    """
+    batch_key = str(uuid.uuid4())
+    for attempt in range(INGEST_INSERT_RETRIES + 1):
+        try:
+            response = http.post(
+                f"{GRAPHRAG_API_URL.rstrip('/')}{INGEST_INSERT_ENDPOINT}",
+                json={'entities': entities, 'relationships': relationships},
+                headers={'Idempotency-Key': batch_key},
+                timeout=INGEST_INSERT_TIMEOUT
+            )
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            status = e.response.status_code if e.response is not None else None
+            if attempt == INGEST_INSERT_RETRIES or (status is not None and status < 500):
+                raise
+            print(f"Insert failed ({e}), retrying")
+            time.sleep(2 ** attempt)
+
+def insert_results(job, results, slots):
+    """Consume extracted chunks and insert them in batches of entities.
+
+    Runs beside the page reader, so DB writes and embedding overlap with
+    parsing and extraction. Every consumed chunk frees a slot for the
+    reader. After an insert error the rest is drained without inserting.
+    """
+    progress = job['progress']
+    entities, relationships = [], []
+
+    def flush():
+        if not entities:
+            return
+        result = insert_batch(entities, relationships)
+        progress['entities_inserted'] += result.get('entities_processed', len(entities))
+        progress['relationships_sent'] += len(relationships)
+        for key in ('embeddings_created', 'edges_created', 'edges_updated'):
+            progress[key] += result.get(key, 0)
+        entities.clear()
+        relationships.clear()
+
+    while True:
+        future = results.get()
+        if future is None:
+            break
+        try:
+            if future.exception() is not None:
+                progress['chunks_failed'] += 1
+                print(f"Extraction failed for a chunk of job {job['id']}: {future.exception()}")
+                continue
+            progress['chunks_extracted'] += 1
+            if job['error'] is not None:
+                continue
+            # A chunk's relationships travel with its entities
+            chunk_entities, chunk_relationships = future.result()
+            entities.extend(chunk_entities)
+            relationships.extend(chunk_relationships)
+            if len(entities) >= INGEST_INSERT_BATCH:
+                flush()
+        except Exception as e:
+            job['error'] = f'Insert failed: {e}'
+        finally:
+            slots.release()
+
+    if job['error'] is None:
+        try:
+            flush()
+        except Exception as e:
+            job['error'] = f'Insert failed: {e}'
+
+def run_ingest_job(job):
+    """Stream a spooled document through chunking, extraction and insert"""
+    progress = job['progress']
+    slots = threading.BoundedSemaphore(INGEST_MAX_IN_FLIGHT)
+    results = queue.Queue()
+    inserter = threading.Thread(
+        target=insert_results, args=(job, results, slots),
+        name=f"insert-{job['id']}", daemon=True
+    )
+    inserter.start()
+
+    def count_pages(pages):
+        for page in pages:
+            progress['pages_read'] += 1
+            yield page
+
+    try:
+        pages = count_pages(iter_pages(job['path'], job['kind']))
+        for chunk in iter_chunks(pages, job['chunk_size']):
+            # Back-pressure: wait while too many chunks are in flight
+            slots.acquire()
+            if job['error'] is not None:
+                slots.release()
+                break
+            progress['chunks_total'] += 1
+            future = extract_executor.submit(extract_entities, chunk)
+            future.add_done_callback(results.put)
+        # Every slot back means every chunk has been consumed
+        for _ in range(INGEST_MAX_IN_FLIGHT):
+            slots.acquire()
+    finally:
+        results.put(None)
+        inserter.join()
+        os.remove(job['path'])
+
+    if job['error'] is not None:
+        raise RuntimeError(job['error'])
+    return dict(progress)
+
+def ingest_worker():
+    """Run queued ingestion jobs one at a time"""
+    while True:
+        job = _job_queue.get()
+        job['status'] = 'running'
+        job['started_at'] = time.time()
+        try:
+            job['result'] = run_ingest_job(job)
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+            print(f"Ingest job {job['id']} failed: {e}")
+        job['finished_at'] = time.time()
+
+def start_ingest_workers():
+    global _workers_started
+    with _jobs_lock:
+        if _workers_started:
+            return
+        _workers_started = True
+    for i in range(INGEST_WORKERS):
+        threading.Thread(target=ingest_worker, name=f'ingest-{i}', daemon=True).start()
+
+def submit_ingest_job(path, kind, filename, chunk_size):
+    """Queue a spooled document; raises queue.Full when the queue is full"""
+    start_ingest_workers()
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'filename': filename,
+        'chunk_size': chunk_size,
+        'path': path,
+        'status': 'queued',
+        'progress': {
+            'pages_read': 0,
+            'chunks_total': 0,
+            'chunks_extracted': 0,
+            'chunks_failed': 0,
+            'entities_inserted': 0,
+            'relationships_sent': 0,
+            'embeddings_created': 0,
+            'edges_created': 0,
+            'edges_updated': 0
+        },
+        'result': None,
+        'error': None,
+        'submitted_at': time.time(),
+        'started_at': None,
+        'finished_at': None
+    }
+    with _jobs_lock:
+        _job_queue.put_nowait(job)
+        _jobs[job['id']] = job
+        # Forget the oldest finished jobs beyond MAX_FINISHED_JOBS
+        finished = [j for j in _jobs.values() if j['finished_at'] is not None]
+        for old in sorted(finished, key=lambda j: j['finished_at'])[:-MAX_FINISHED_JOBS]:
+            del _jobs[old['id']]
+    return job
+
+def job_status(job):
+    """Public view of a job (without the spool path)"""
+    status = {k: v for k, v in job.items() if k != 'path'}
+    status['progress'] = dict(job['progress'])
+    return status
+
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'ok'})
+    return jsonify({
+        'status': 'ok',
+        'ingest': {
+            'queued': _job_queue.qsize(),
+            'max_queued': INGEST_MAX_QUEUED,
+            'running': sum(1 for j in list(_jobs.values()) if j['status'] == 'running'),
+            'extraction_configured': bool(LLM_API_URL)
+        }
+    })
 
 @app.route('/extract/pdf', methods=['POST'])
 def extract_pdf():
@@ -21,9 +332,7 @@ def extract_pdf():
         file = request.files['file']
         pdf_reader = PyPDF2.PdfReader(io.BytesIO(file.read()))
         
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n\n"
+        text = "".join(page.extract_text() + "\n\n" for page in pdf_reader.pages)
         
         return jsonify({
             'text': text,
@@ -43,9 +352,7 @@ def extract_docx():
         file = request.files['file']
         doc = docx.Document(io.BytesIO(file.read()))
         
-        text = ""
-        for para in doc.paragraphs:
-            text += para.text + "\n\n"
+        text = "".join(para.text + "\n\n" for para in doc.paragraphs)
         
         return jsonify({
             'text': text,
@@ -72,5 +379,54 @@ def extract_text():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    """Queue a document for chunking, entity extraction and graph insert"""
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': 'No file provided'}), 400
+        if not LLM_API_URL:
+            return jsonify({'error': 'Entity extraction is not configured (set LLM_API_URL)'}), 503
+        if _job_queue.full():
+            response = jsonify({'error': 'Too many queued ingestion jobs, retry later'})
+            response.headers['Retry-After'] = '30'
+            return response, 429
+            
+        file = request.files['file']
+        extension = (file.filename or '').rsplit('.', 1)[-1].lower()
+        kind = {'pdf': 'pdf', 'docx': 'docx', 'doc': 'docx'}.get(extension, 'text')
+        chunk_size = int(request.form.get('chunk_size', INGEST_CHUNK_SIZE))
+        if chunk_size <= 0:
+            return jsonify({'error': 'chunk_size must be positive'}), 400
+        
+        # Spool to disk so queued jobs don't hold their uploads in memory
+        fd, path = tempfile.mkstemp(prefix='ingest-', suffix=f'.{extension}', dir=INGEST_SPOOL_DIR)
+        with os.fdopen(fd, 'wb') as spool:
+            file.save(spool)
+        
+        try:
+            job = submit_ingest_job(path, kind, file.filename, chunk_size)
+        except queue.Full:
+            os.remove(path)
+            response = jsonify({'error': 'Too many queued ingestion jobs, retry later'})
+            response.headers['Retry-After'] = '30'
+            return response, 429
+        
+        return jsonify({
+            'job_id': job['id'],
+            'status': job['status'],
+            'status_url': f"/ingest/{job['id']}"
+        }), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/ingest/<job_id>', methods=['GET'])
+def get_ingest_job(job_id):
+    """Status and progress of an ingestion job"""
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job_status(job))
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5006, debug=True)
@@ -0,0 +1,186 @@
+from flask import Flask, request, jsonify
+from concurrent.futures import Future
+from collections import deque
+import threading
+import queue
+import time
+import os
+from embedding_models import EMBEDDING_MODEL, EMBEDDING_BACKEND, load_checked_model
+
+app = Flask(__name__)
+
+# Backend actually serving: EMBEDDING_BACKEND, or torch after a failed parity check
+EMBEDDING_BACKEND_ACTIVE = None
+
+# Micro-batching: collect requests for up to MAX_WAIT_MS or MAX_BATCH_SIZE texts
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '128'))
+MAX_WAIT_MS = float(os.getenv('MAX_WAIT_MS', '5'))
+# Reject new work (503) once this many texts are waiting
+MAX_QUEUED_TEXTS = int(os.getenv('MAX_QUEUED_TEXTS', '20000'))
+
+model = None
+_pending = queue.Queue()
+_metrics_lock = threading.Lock()
+_recent = deque()  # (finished_at, texts) for the throughput window
+metrics = {
+    'requests': 0,
+    'rejected': 0,
+    'texts': 0,
+    'batches': 0,
+    'encoded_texts': 0,
+    'queued_texts': 0,
+    'encode_seconds': 0.0,
+    'wait_seconds': 0.0
+}
+
+def load_model():
+    """Load the model once, checking a non-torch backend against torch"""
+    global model, EMBEDDING_BACKEND_ACTIVE
+    m, backend = load_checked_model(EMBEDDING_BACKEND)
+    m.encode(['warm-up'], show_progress_bar=False)
+    EMBEDDING_BACKEND_ACTIVE = backend
+    model = m
+    print(f"Model loaded! Dimension: {model.get_sentence_embedding_dimension()}")
+
+class _Job:
+    __slots__ = ('texts', 'future', 'enqueued_at')
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+def _batch_loop():
+    """Single encoder thread: merge queued jobs into micro-batches"""
+    while True:
+        jobs = [_pending.get()]
+        count = len(jobs[0].texts)
+        deadline = time.monotonic() + MAX_WAIT_MS / 1000
+
+        while count < MAX_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = _pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            count += len(job.texts)
+
+        texts = [t for job in jobs for t in job.texts]
+        started = time.monotonic()
+        try:
+            vectors = model.encode(texts, batch_size=MAX_BATCH_SIZE, show_progress_bar=False)
+            offset = 0
+            for job in jobs:
+                job.future.set_result(vectors[offset:offset + len(job.texts)])
+                offset += len(job.texts)
+        except Exception as e:
+            if len(jobs) == 1:
+                jobs[0].future.set_exception(e)
+            else:
+                # Retry the jobs one by one so only the failing request errors
+                for job in jobs:
+                    try:
+                        job.future.set_result(
+                            model.encode(job.texts, batch_size=MAX_BATCH_SIZE, show_progress_bar=False)
+                        )
+                    except Exception as job_error:
+                        job.future.set_exception(job_error)
+        finished = time.monotonic()
+
+        with _metrics_lock:
+            metrics['batches'] += 1
+            metrics['encoded_texts'] += len(texts)
+            metrics['queued_texts'] -= len(texts)
+            metrics['encode_seconds'] += finished - started
+            metrics['wait_seconds'] += sum(started - job.enqueued_at for job in jobs)
+            _recent.append((finished, len(texts)))
+
+def embed_texts(texts):
+    """Queue texts for the encoder thread and wait for their vectors.
+
+    Large requests are split into MAX_BATCH_SIZE chunks so they
+    interleave fairly with small concurrent queries.
+    """
+    jobs = [_Job(texts[i:i + MAX_BATCH_SIZE]) for i in range(0, len(texts), MAX_BATCH_SIZE)]
+    with _metrics_lock:
+        metrics['queued_texts'] += len(texts)
+    for job in jobs:
+        _pending.put(job)
+    vectors = []
+    for job in jobs:
+        vectors.extend(job.future.result())
+    return vectors
+
+@app.route('/health', methods=['GET'])
+def health():
+    if model is None:
+        return jsonify({'status': 'loading'}), 503
+    return jsonify({
+        'status': 'ok',
+        'model': EMBEDDING_MODEL,
+        'backend': EMBEDDING_BACKEND_ACTIVE,
+        'dimensions': model.get_sentence_embedding_dimension()
+    })
+
+@app.route('/embed', methods=['POST'])
+def embed():
+    """Embed a list of texts; empty texts come back as null"""
+    try:
+        if model is None:
+            return jsonify({'error': 'Model is still loading'}), 503
+
+        data = request.json
+        texts = data.get('texts', [])
+        # Checked per request, so a bad text never reaches a shared micro-batch
+        if not isinstance(texts, list) or any(t is not None and not isinstance(t, str) for t in texts):
+            return jsonify({'error': 'texts must be a list of strings'}), 400
+
+        with _metrics_lock:
+            if metrics['queued_texts'] + len(texts) > MAX_QUEUED_TEXTS:
+                metrics['rejected'] += 1
+                return jsonify({'error': 'Embedding queue is full, retry later'}), 503
+            metrics['requests'] += 1
+            metrics['texts'] += len(texts)
+
+        cleaned = [(i, (t or '').replace("\n", " ").strip()) for i, t in enumerate(texts)]
+        cleaned = [(i, t) for i, t in cleaned if t]
+
+        embeddings = [None] * len(texts)
+        vectors = embed_texts([t for _, t in cleaned])
+        for (i, _), vector in zip(cleaned, vectors):
+            embeddings[i] = vector.tolist()
+
+        return jsonify({
+            'model': EMBEDDING_MODEL,
+            'embeddings': embeddings
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Queue depth, batching efficiency and recent throughput"""
+    now = time.monotonic()
+    with _metrics_lock:
+        while _recent and now - _recent[0][0] > 60:
+            _recent.popleft()
+        recent_texts = sum(n for _, n in _recent)
+        snapshot = dict(metrics)
+    return jsonify({
+        **snapshot,
+        'queued_jobs': _pending.qsize(),
+        'avg_batch_size': round(snapshot['encoded_texts'] / snapshot['batches'], 2) if snapshot['batches'] else None,
+        'avg_wait_ms': round(snapshot['wait_seconds'] / snapshot['batches'] * 1000, 2) if snapshot['batches'] else None,
+        'texts_per_second_1m': round(recent_texts / 60, 2),
+        'max_batch_size': MAX_BATCH_SIZE,
+        'max_wait_ms': MAX_WAIT_MS
+    })
+
+threading.Thread(target=_batch_loop, name='encoder', daemon=True).start()
+threading.Thread(target=load_model, name='model-loader', daemon=True).start()
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5007, threaded=True)
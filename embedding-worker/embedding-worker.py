@@ -1,43 +1,227 @@
-from sentence_transformers import SentenceTransformer
+#!/usr/bin/env python3
 import psycopg2
+from psycopg2.extras import execute_values
+import numpy as np
+import requests
+import select
 import time
+import os
+from embedding_models import EMBEDDING_MODEL, EMBEDDING_BACKEND, load_checked_model
 
 DB = {
-    'host': 'yugabytedb',
-    'port': 5433,
-    'database': 'graphrag',
-    'user': 'yugabyte',
-    'password': 'yugabyte'
+    'host': os.getenv('DB_HOST', 'yugabytedb'),
+    'port': int(os.getenv('DB_PORT', '5433')),
+    'database': os.getenv('DB_NAME', 'graphrag'),
+    'user': os.getenv('DB_USER', 'yugabyte'),
+    'password': os.getenv('DB_PASSWORD', 'yugabyte')
 }
+if os.getenv('DB_SSLMODE'):
+    DB['sslmode'] = os.getenv('DB_SSLMODE')
 
-print("Loading embedding model (first run will download ~90MB)...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-print(f"✅ Model loaded! Dimension: {model.get_sentence_embedding_dimension()}")
+# Shared embedding-service; when set the model is not loaded in this process
+EMBEDDING_SERVICE_URL = os.getenv('EMBEDDING_SERVICE_URL', '')
+# Large claims take a while to encode, so allow a generous timeout
+EMBEDDING_SERVICE_TIMEOUT = float(os.getenv('EMBEDDING_SERVICE_TIMEOUT', '300'))
+# Rows claimed (and written back) per transaction
+CLAIM_BATCH_SIZE = int(os.getenv('CLAIM_BATCH_SIZE', '512'))
+# Texts per model.encode() call
+ENCODE_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+# Longest sleep between polls when LISTEN/NOTIFY isn't available or stays quiet
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', '30'))
+MIN_POLL_INTERVAL = float(os.getenv('MIN_POLL_INTERVAL', '1'))
+NOTIFY_CHANNEL = os.getenv('EMBEDDING_NOTIFY_CHANNEL', 'graph_nodes_embedding')
 
-while True:
+model = None
+
+class RemoteEmbedder:
+    """Client for the shared embedding-service with an encode() like SentenceTransformer"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def encode(self, sentences, batch_size=None, show_progress_bar=False):
+        response = self.session.post(
+            f'{self.url}/embed', json={'texts': list(sentences)}, timeout=EMBEDDING_SERVICE_TIMEOUT
+        )
+        response.raise_for_status()
+        embeddings = response.json()['embeddings']
+        if any(e is None for e in embeddings):
+            raise ValueError('Embedding service returned no vector for an empty text')
+        return np.asarray(embeddings, dtype=np.float32)
+
+def load_model():
+    """Load the embedding model once per process"""
+    global model
+    if model is None and EMBEDDING_SERVICE_URL:
+        print(f"Using embedding service at {EMBEDDING_SERVICE_URL}")
+        model = RemoteEmbedder(EMBEDDING_SERVICE_URL)
+    if model is None:
+        model, _ = load_checked_model(EMBEDDING_BACKEND)
+        print(f"Model loaded! Dimension: {model.get_sentence_embedding_dimension()}")
+    return model
+
+def requeue_other_models(conn):
+    """Mark nodes embedded by a different model as stale.
+
+    Run once at startup so switching EMBEDDING_MODEL re-embeds only
+    what the old model produced.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE graph_nodes
+        SET embedding_hash = NULL
+        WHERE embedding IS NOT NULL
+          AND embedding_hash IS NOT NULL
+          AND embedding_model IS DISTINCT FROM %s
+    """, (EMBEDDING_MODEL,))
+    requeued = cur.rowcount
+    conn.commit()
+    cur.close()
+    if requeued:
+        print(f"Re-queued {requeued} nodes embedded with another model")
+    return requeued
+
+def add_embeddings_batch(conn):
+    """Claim, encode and write back one batch of nodes needing embeddings.
+
+    A node needs (re-)embedding when its embedding_hash doesn't match the
+    content_hash of its current name/type/description. Rows are claimed
+    with FOR UPDATE SKIP LOCKED, so any number of workers can run side by
+    side without embedding the same node twice. Returns the number of
+    embeddings written.
+    """
+    cur = conn.cursor()
     try:
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
-        
-        cur.execute("SELECT id, entity_name, entity_type, description FROM graph_nodes WHERE embedding IS NULL LIMIT 10")
+        cur.execute("""
+            SELECT id, entity_name, entity_type, description, content_hash
+            FROM graph_nodes
+            WHERE embedding_hash IS DISTINCT FROM content_hash
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (CLAIM_BATCH_SIZE,))
+
         nodes = cur.fetchall()
-        
         if not nodes:
-            print("✅ All nodes have embeddings. Sleeping 30s...")
-            time.sleep(30)
-            continue
-        
-        for node_id, name, typ, desc in nodes:
-            text = f"{name} {typ or ''} {desc or ''}"
-            emb = model.encode(text, show_progress_bar=False)
-            cur.execute("UPDATE graph_nodes SET embedding = %s WHERE id = %s", (emb.tolist(), node_id))
-            print(f"✅ Added embedding: {name}")
-        
+            conn.rollback()
+            return 0
+
+        # Same text as graphrag-api's embedding_text(), hashed by content_hash
+        texts = [f"{name} {typ or ''} {desc or ''}" for _, name, typ, desc, _ in nodes]
+        # Blank texts have no embedding: store NULL with the hash so the
+        # row isn't claimed again (and can't block the rest of the claim)
+        embeddable = [i for i, text in enumerate(texts) if text.replace("\n", " ").strip()]
+        vectors = [None] * len(nodes)
+        if embeddable:
+            encoded = load_model().encode(
+                [texts[i] for i in embeddable],
+                batch_size=ENCODE_BATCH_SIZE,
+                show_progress_bar=False
+            )
+            for i, vector in zip(embeddable, encoded):
+                vectors[i] = vector.tolist()
+        if len(embeddable) < len(nodes):
+            print(f"Skipped {len(nodes) - len(embeddable)} nodes with no text to embed")
+
+        execute_values(cur, """
+            UPDATE graph_nodes AS n
+            SET embedding = v.embedding::vector,
+                embedding_hash = v.embedding_hash,
+                embedding_model = v.embedding_model,
+                updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(id, embedding, embedding_hash, embedding_model)
+            WHERE n.id = v.id::uuid
+        """, [
+            (node_id, vector, text_hash, EMBEDDING_MODEL)
+            for (node_id, _, _, _, text_hash), vector in zip(nodes, vectors)
+        ], page_size=CLAIM_BATCH_SIZE)
+
+        # Let graphrag-api drop cached search results
+        cur.execute("UPDATE graph_meta SET version = version + 1 WHERE id = 1")
+
         conn.commit()
+        return len(nodes)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
         cur.close()
-        conn.close()
-        print(f"📊 Batch complete: {len(nodes)} embeddings added\n")
-        
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        time.sleep(10)
+
+def open_listener():
+    """LISTEN for new-node notifications; None if the server doesn't support it"""
+    try:
+        conn = psycopg2.connect(**DB)
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        cur.close()
+        print(f"Listening for notifications on '{NOTIFY_CHANNEL}'")
+        return conn
+    except psycopg2.Error as e:
+        print(f"LISTEN unavailable ({e}); falling back to polling")
+        return None
+
+def wait_for_work(listener, timeout):
+    """Block until notified or ``timeout`` seconds pass"""
+    if listener is None:
+        time.sleep(timeout)
+        return
+    if select.select([listener], [], [], timeout) != ([], [], []):
+        listener.poll()
+        listener.notifies.clear()
+
+def drain(conn):
+    """Embed batches until no unclaimed node needs an embedding"""
+    total = 0
+    while True:
+        added = add_embeddings_batch(conn)
+        if not added:
+            return total
+        total += added
+        print(f"✅ Added {added} embeddings")
+
+def run():
+    load_model()
+    conn = None
+    listener = None
+    listener_checked = False
+    requeued = False
+    idle = MIN_POLL_INTERVAL
+
+    while True:
+        try:
+            if conn is None or conn.closed:
+                conn = psycopg2.connect(**DB)
+            if not requeued:
+                requeue_other_models(conn)
+                requeued = True
+            if not listener_checked:
+                listener = open_listener()
+                listener_checked = True
+
+            if drain(conn):
+                idle = MIN_POLL_INTERVAL
+                continue
+
+            # Nothing to do: wait for a notification, or back off while polling
+            if listener is not None:
+                wait_for_work(listener, POLL_INTERVAL)
+            else:
+                wait_for_work(None, idle)
+                idle = min(idle * 2, POLL_INTERVAL)
+        except KeyboardInterrupt:
+            print("\nStopping...")
+            break
+        except Exception as e:
+            print(f"Error: {e}")
+            for c in (conn, listener):
+                if c is not None and not c.closed:
+                    c.close()
+            conn = None
+            listener = None
+            listener_checked = False
+            time.sleep(10)
+
+if __name__ == '__main__':
+    print("Starting embedding worker...")
+    run()
@@ -2,7 +2,7 @@
 
 # Build the Docker image
 echo "Building embedding-worker image..."
-docker build -f Dockerfile.embedding-worker -t embedding-worker:latest .
+docker build --build-context shared=../shared -f Dockerfile.embedding-worker -t embedding-worker:latest .
 
 # Stop and remove old container if it exists
 echo "Removing old container if exists..."
@@ -1,76 +1,2843 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+from psycopg2 import extensions as pg_extensions
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
+from array import array
+from embedding_models import EMBEDDING_MODEL, EMBEDDING_BACKEND, load_checked_model
+import numpy as np
 import psycopg2
+import requests
+import sqlite3
+import threading
+import base64
+import copy
+import functools
+import hashlib
 import json
 import os
+import re
+import time
+import uuid
 
 app = Flask(__name__)
 CORS(app)
 
 DB = {
-    'host': 'yugabytedb',
-    'port': 5433,
-    'database': 'graphrag',
-    'user': 'yugabyte',
-    'password': 'yugabyte'
+    'host': os.getenv('DB_HOST', 'yugabytedb'),
+    'port': int(os.getenv('DB_PORT', '5433')),
+    'database': os.getenv('DB_NAME', 'graphrag'),
+    'user': os.getenv('DB_USER', 'yugabyte'),
+    'password': os.getenv('DB_PASSWORD', 'yugabyte')
 }
+if os.getenv('DB_SSLMODE'):
+    DB['sslmode'] = os.getenv('DB_SSLMODE')
+
+# Connection pool settings
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '2'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '20'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_HEALTHCHECK = os.getenv('DB_POOL_HEALTHCHECK', 'true').lower() in ('1', 'true', 'yes')
+
+# Rows per multi-row INSERT statement during bulk ingest
+INGEST_PAGE_SIZE = int(os.getenv('INGEST_PAGE_SIZE', '1000'))
+# Hours an Idempotency-Key of the batch-insert endpoints is remembered
+INGEST_BATCH_KEY_TTL = float(os.getenv('INGEST_BATCH_KEY_TTL', '24'))
+
+# Default cap on neighbours returned per search hit (0 = unlimited)
+MAX_CONNECTIONS_PER_NODE = int(os.getenv('MAX_CONNECTIONS_PER_NODE', '50'))
+
+# Upper bound on the hops a traversal request may ask for
+MAX_EXPAND_HOPS = int(os.getenv('MAX_EXPAND_HOPS', '4'))
+
+# Upper bound on the queries one batch semantic-search request may carry
+MAX_BATCH_QUERIES = int(os.getenv('MAX_BATCH_QUERIES', '64'))
+
+# Optional in-memory copy of the graph used for traversal and vector search
+GRAPH_SNAPSHOT = os.getenv('GRAPH_SNAPSHOT', 'false').lower() in ('1', 'true', 'yes')
+GRAPH_SNAPSHOT_EMBEDDINGS = os.getenv('GRAPH_SNAPSHOT_EMBEDDINGS', 'true').lower() in ('1', 'true', 'yes')
+GRAPH_SNAPSHOT_REFRESH = float(os.getenv('GRAPH_SNAPSHOT_REFRESH', '30'))
+GRAPH_SNAPSHOT_RELOAD = float(os.getenv('GRAPH_SNAPSHOT_RELOAD', '3600'))
+graph_snapshot = None
+_snapshot_reload_requested = False
+
+# /graph/visualize page size (default and upper bound)
+VISUALIZE_PAGE_SIZE = int(os.getenv('VISUALIZE_PAGE_SIZE', '1000'))
+VISUALIZE_MAX_PAGE_SIZE = int(os.getenv('VISUALIZE_MAX_PAGE_SIZE', '10000'))
+
+# ANN index on graph_nodes.embedding (ybhnsw on YugabyteDB, hnsw/ivfflat on pgvector)
+VECTOR_INDEX_NAME = 'idx_nodes_embedding'
+VECTOR_INDEX_METHOD = os.getenv('VECTOR_INDEX_METHOD', 'ybhnsw')
+
+# Worker threads for running search candidate generators concurrently
+SEARCH_WORKERS = int(os.getenv('SEARCH_WORKERS', '8'))
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='search')
+
+# Response cache for read endpoints, invalidated by the graph version counter
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_TTL = float(os.getenv('RESULT_CACHE_TTL', '300'))
+RESULT_CACHE_VERSION_CHECK = float(os.getenv('RESULT_CACHE_VERSION_CHECK', '2'))
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+_graph_version = None
+_graph_version_checked = 0.0
+result_cache_stats = {
+    'hits': 0,
+    'misses': 0
+}
+
+# Long-running maintenance jobs started with {"async": true}
+MAX_FINISHED_JOBS = int(os.getenv('MAX_FINISHED_JOBS', '100'))
+DEDUP_BATCH_SIZE = int(os.getenv('DEDUP_BATCH_SIZE', '500'))
+
+# Degree/PageRank refresh: seconds to wait after an ingest (0 = only on request)
+CENTRALITY_REFRESH_DELAY = float(os.getenv('CENTRALITY_REFRESH_DELAY', '60'))
+CENTRALITY_DAMPING = float(os.getenv('CENTRALITY_DAMPING', '0.85'))
+CENTRALITY_WRITE_BATCH = int(os.getenv('CENTRALITY_WRITE_BATCH', '5000'))
+_centrality_timer = None
+_centrality_job = None
+_centrality_lock = threading.Lock()
+
+# Community detection (Louvain) used by /graph/community-search
+COMMUNITY_RESOLUTION = float(os.getenv('COMMUNITY_RESOLUTION', '1.0'))
+COMMUNITY_MIN_SIZE = int(os.getenv('COMMUNITY_MIN_SIZE', '2'))
+COMMUNITY_MAX_LEVELS = int(os.getenv('COMMUNITY_MAX_LEVELS', '5'))
+COMMUNITY_TOP_ENTITIES = int(os.getenv('COMMUNITY_TOP_ENTITIES', '10'))
+_community_job = None
+_community_lock = threading.Lock()
+
+# How a repeated (source, target, relationship_type) edge combines weights: sum or max
+EDGE_WEIGHT_MODE = os.getenv('EDGE_WEIGHT_MODE', 'sum')
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+db_pool = None
+_db_pool_lock = threading.Lock()
+# Bounds concurrent checkouts so callers wait instead of getting PoolError
+_db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+db_pool_stats = {
+    'checkouts': 0,
+    'in_use': 0,
+    'reconnects': 0,
+    'timeouts': 0
+}
+
+def init_db_pool():
+    """Create the shared connection pool (once per process)"""
+    global db_pool
+    if db_pool is None:
+        with _db_pool_lock:
+            if db_pool is None:
+                db_pool = pg_pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **DB)
+                print(f"DB pool ready ({DB_POOL_MIN}-{DB_POOL_MAX} connections to {DB['host']}:{DB['port']})")
+    return db_pool
+
+def _connection_ok(conn):
+    """Cheap liveness check run on checkout"""
+    if conn.closed:
+        return False
+    if not DB_POOL_HEALTHCHECK:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.fetchone()
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+@contextmanager
+def get_db_connection():
+    """Check out a pooled connection, returning it to the pool afterwards.
+
+    Uncommitted work is rolled back on release so the next caller always
+    gets a connection in a clean state.
+    """
+    pool = init_db_pool()
+    if not _db_pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        db_pool_stats['timeouts'] += 1
+        raise RuntimeError(f'Timed out after {DB_POOL_TIMEOUT}s waiting for a DB connection')
+
+    conn = None
+    try:
+        conn = pool.getconn()
+        if not _connection_ok(conn):
+            pool.putconn(conn, close=True)
+            db_pool_stats['reconnects'] += 1
+            conn = pool.getconn()
+
+        db_pool_stats['checkouts'] += 1
+        db_pool_stats['in_use'] += 1
+        try:
+            yield conn
+        finally:
+            db_pool_stats['in_use'] -= 1
+            broken = conn.closed != 0
+            if not broken and conn.get_transaction_status() != pg_extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            pool.putconn(conn, close=broken)
+            conn = None
+    finally:
+        if conn is not None:
+            pool.putconn(conn, close=True)
+        _db_pool_slots.release()
+
+def get_db_pool_stats():
+    """Snapshot of pool configuration and usage for /health"""
+    return {
+        'min': DB_POOL_MIN,
+        'max': DB_POOL_MAX,
+        'initialized': db_pool is not None,
+        'open_connections': len(db_pool._used) + len(db_pool._pool) if db_pool is not None else 0,
+        'idle_connections': len(db_pool._pool) if db_pool is not None else 0,
+        **db_pool_stats
+    }
 
 # Initialize sentence transformer for local embeddings
 embedder = None
 EMBEDDINGS_AVAILABLE = False
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+EMBEDDING_NOTIFY_CHANNEL = os.getenv('EMBEDDING_NOTIFY_CHANNEL', 'graph_nodes_embedding')
+_embedder_lock = threading.Lock()
+
+# Load the model in the background at startup instead of on first use
+EMBEDDING_WARMUP = os.getenv('EMBEDDING_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+MODEL_WARM = False
+
+# Shared embedding-service; when set the model is not loaded in this process
+EMBEDDING_SERVICE_URL = os.getenv('EMBEDDING_SERVICE_URL', '')
+EMBEDDING_SERVICE_TIMEOUT = float(os.getenv('EMBEDDING_SERVICE_TIMEOUT', '30'))
+
+# Backend in use: EMBEDDING_BACKEND, torch after a failed parity check, or 'service'
+EMBEDDING_BACKEND_ACTIVE = None
+
+# LRU cache of query text -> embedding, optionally backed by a shared SQLite file
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '3600'))
+QUERY_CACHE_PATH = os.getenv('QUERY_CACHE_PATH', '')
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+query_cache_stats = {
+    'hits': 0,
+    'shared_hits': 0,
+    'misses': 0,
+    'evictions': 0
+}
+
+def warm_up():
+    """Load the model, run a dummy encode and open the DB pool.
+
+    Runs in a background thread at startup so the first real request
+    doesn't pay for model loading; /ready reports when it's done.
+    """
+    global MODEL_WARM
+    started = time.time()
+    try:
+        init_db_pool()
+    except Exception as e:
+        print(f"DB pool warm-up failed: {e}")
+    # Keep trying: the embedding service may still be loading its model
+    while get_embedding('warm-up') is None:
+        print("Warm-up: embedding model unavailable, retrying in 5s")
+        time.sleep(5)
+    MODEL_WARM = True
+    print(f"Warm-up finished in {time.time() - started:.1f}s")
+
+def start_warm_up():
+    if EMBEDDING_WARMUP:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+class RemoteEmbedder:
+    """Client for the shared embedding-service.
+
+    Mimics SentenceTransformer.encode() so callers don't care whether
+    the model is local or remote.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def encode(self, sentences, batch_size=None, show_progress_bar=False, normalize_embeddings=False):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        response = self.session.post(
+            f'{self.url}/embed', json={'texts': texts}, timeout=EMBEDDING_SERVICE_TIMEOUT
+        )
+        response.raise_for_status()
+        embeddings = response.json()['embeddings']
+        if any(e is None for e in embeddings):
+            raise ValueError('Embedding service returned no vector for an empty text')
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if normalize_embeddings:
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors[0] if single else vectors
 
 def init_embedder():
     """Initialize the embedding model (lazy loading)"""
-    global embedder, EMBEDDINGS_AVAILABLE
+    global embedder, EMBEDDINGS_AVAILABLE, EMBEDDING_BACKEND_ACTIVE
     if embedder is None:
+        with _embedder_lock:
+            if embedder is not None:
+                return embedder
+            if EMBEDDING_SERVICE_URL:
+                # Model lives in embedding-service; nothing to load here
+                embedder = RemoteEmbedder(EMBEDDING_SERVICE_URL)
+                EMBEDDING_BACKEND_ACTIVE = 'service'
+                EMBEDDINGS_AVAILABLE = True
+                return embedder
+            try:
+                model, backend = load_checked_model(EMBEDDING_BACKEND)
+                embedder = model
+                EMBEDDING_BACKEND_ACTIVE = backend
+                EMBEDDINGS_AVAILABLE = True
+                print("Embedding model loaded successfully!")
+            except Exception as e:
+                print(f"Failed to load embedding model: {e}")
+                EMBEDDINGS_AVAILABLE = False
+    return embedder
+
+def get_embedding(text: str):
+    """Generate embedding for text using local model"""
+    try:
+        model = init_embedder()
+        if model is None:
+            return None
+        
+        # Clean text
+        text = text.replace("\n", " ").strip()
+        if not text:
+            return None
+        
+        # Generate embedding (returns 384-dimensional vector)
+        embedding = model.encode(text, show_progress_bar=False)
+        return embedding.tolist()
+    except Exception as e:
+        print(f"Embedding error: {e}")
+        return None
+
+def embedding_text(name, typ, desc):
+    """Text a node is embedded from.
+
+    Must stay in sync with the content_hash column in init-db.sql, which
+    is md5 of the same concatenation.
+    """
+    return f"{name} {typ or ''} {desc or ''}"
+
+def content_hash(text):
+    """md5 hex digest matching graph_nodes.content_hash"""
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+def get_embeddings(texts, batch_size=None):
+    """Generate embeddings for many texts with batched model calls.
+
+    Returns a list aligned with ``texts``; entries are None for empty
+    texts or texts that failed to encode.
+    """
+    results = [None] * len(texts)
+    model = init_embedder()
+    if model is None:
+        return results
+
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+
+    # Clean texts, skipping empty ones but remembering their positions
+    cleaned = []
+    for i, text in enumerate(texts):
+        text = (text or '').replace("\n", " ").strip()
+        if text:
+            cleaned.append((i, text))
+
+    for start in range(0, len(cleaned), batch_size):
+        chunk = cleaned[start:start + batch_size]
         try:
-            from sentence_transformers import SentenceTransformer
-            print("Loading embedding model...")
-            # Using a lightweight model (384 dimensions)
-            embedder = SentenceTransformer('all-MiniLM-L6-v2')
-            EMBEDDINGS_AVAILABLE = True
-            print("Embedding model loaded successfully!")
+            vectors = model.encode(
+                [t for _, t in chunk],
+                batch_size=batch_size,
+                show_progress_bar=False
+            )
+            for (i, _), vector in zip(chunk, vectors):
+                results[i] = vector.tolist()
         except Exception as e:
-            print(f"Failed to load embedding model: {e}")
-            EMBEDDINGS_AVAILABLE = False
-    return embedder
+            # Fall back to one-by-one so a single bad text doesn't sink the batch
+            print(f"Batch embedding error, retrying items individually: {e}")
+            for i, text in chunk:
+                results[i] = get_embedding(text)
+
+    return results
+
+def _normalize_query(text):
+    """Cache key for a query: case- and whitespace-insensitive"""
+    return ' '.join((text or '').lower().split())
+
+_shared_cache_local = threading.local()
+
+def init_shared_cache():
+    """Create the shared query cache's table once at startup"""
+    if not QUERY_CACHE_PATH:
+        return
+    try:
+        conn = sqlite3.connect(QUERY_CACHE_PATH, timeout=5)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                model TEXT NOT NULL,
+                query TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (model, query)
+            )
+        """)
+        conn.commit()
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"Shared query cache unavailable: {e}")
+
+def _shared_cache_connect():
+    """This thread's connection to the shared query cache"""
+    conn = getattr(_shared_cache_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(QUERY_CACHE_PATH, timeout=5)
+        _shared_cache_local.conn = conn
+    return conn
+
+def _shared_cache_get(key):
+    try:
+        row = _shared_cache_connect().execute(
+            "SELECT vector, created_at FROM query_embeddings WHERE model = ? AND query = ?",
+            (EMBEDDING_MODEL, key)
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Shared query cache read error: {e}")
+        return None
+    if row is None or time.time() - row[1] > QUERY_CACHE_TTL:
+        return None
+    return array('f', row[0]).tolist()
+
+def _shared_cache_put(key, embedding):
+    try:
+        conn = _shared_cache_connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                (EMBEDDING_MODEL, key, array('f', embedding).tobytes(), time.time())
+            )
+    except sqlite3.Error as e:
+        print(f"Shared query cache write error: {e}")
+
+def get_query_embedding(query):
+    """Embedding for a search query, served from cache when possible.
+
+    Looks in the in-process LRU first, then the optional shared SQLite
+    store (QUERY_CACHE_PATH), and only then runs the model. Entries
+    expire after QUERY_CACHE_TTL seconds.
+    """
+    return get_query_embeddings([query])[0]
+
+def get_query_embeddings(queries):
+    """Embeddings for many search queries, aligned with ``queries``.
+
+    Same cache lookups as get_query_embedding(), but every query that
+    misses both caches is encoded in a single batched model call.
+    Entries are None for queries that could not be embedded.
+    """
+    if QUERY_CACHE_SIZE <= 0:
+        return get_embeddings(queries)
+
+    keys = [_normalize_query(q) for q in queries]
+    found = {}
+    now = time.time()
+    with _query_cache_lock:
+        for key in dict.fromkeys(keys):
+            entry = _query_cache.get(key)
+            if entry is not None and entry[0] > now:
+                _query_cache.move_to_end(key)
+                query_cache_stats['hits'] += 1
+                found[key] = entry[1]
+
+    # First spelling of each normalised query is the one encoded
+    texts = {}
+    for key, query in zip(keys, queries):
+        texts.setdefault(key, query)
+
+    computed = {}
+    missing = []
+    for key in texts:
+        if key in found:
+            continue
+        embedding = _shared_cache_get(key) if QUERY_CACHE_PATH else None
+        if embedding is not None:
+            query_cache_stats['shared_hits'] += 1
+            computed[key] = embedding
+        else:
+            query_cache_stats['misses'] += 1
+            missing.append(key)
+
+    if missing:
+        for key, embedding in zip(missing, get_embeddings([texts[k] for k in missing])):
+            if embedding is None:
+                continue
+            if QUERY_CACHE_PATH:
+                _shared_cache_put(key, embedding)
+            computed[key] = embedding
+
+    if computed:
+        with _query_cache_lock:
+            for key, embedding in computed.items():
+                _query_cache[key] = (now + QUERY_CACHE_TTL, embedding)
+                _query_cache.move_to_end(key)
+            while len(_query_cache) > QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+                query_cache_stats['evictions'] += 1
+        found.update(computed)
+    return [found.get(key) for key in keys]
+
+def get_query_cache_stats():
+    """Query embedding cache usage for /health"""
+    lookups = query_cache_stats['hits'] + query_cache_stats['shared_hits'] + query_cache_stats['misses']
+    return {
+        'size': len(_query_cache),
+        'max_size': QUERY_CACHE_SIZE,
+        'ttl_seconds': QUERY_CACHE_TTL,
+        'shared_backend': QUERY_CACHE_PATH or None,
+        'hit_rate': round((lookups - query_cache_stats['misses']) / lookups, 4) if lookups else None,
+        **query_cache_stats
+    }
+
+def upsert_nodes(cur, entities, embeddings=None):
+    """Upsert entities with multi-row INSERT ... ON CONFLICT statements.
+
+    Entities repeated in the payload are folded together first (a single
+    statement can't update the same row twice). Returns a dict mapping
+    entity name to node id.
+    """
+    if embeddings is None:
+        embeddings = [None] * len(entities)
+
+    rows = {}
+    for entity, embedding in zip(entities, embeddings):
+        name = entity['name']
+        # Hash of the text the embedding was computed from (see content_hash)
+        text_hash = content_hash(embedding_text(
+            name, entity.get('type'), entity.get('description')
+        )) if embedding else None
+        model = EMBEDDING_MODEL if embedding else None
+        if name not in rows:
+            rows[name] = [name, entity.get('type'), entity.get('description'), embedding, text_hash, model]
+        else:
+            # Later mentions win for description/embedding, like sequential upserts
+            row = rows[name]
+            if entity.get('description') is not None:
+                row[2] = entity.get('description')
+            if embedding:
+                row[3:6] = [embedding, text_hash, model]
+
+    entity_ids = {}
+    if not rows:
+        return entity_ids
+
+    # A description change makes the stored content_hash differ from
+    # embedding_hash, which queues the node for re-embedding
+    returned = execute_values(cur, """
+        INSERT INTO graph_nodes (entity_name, entity_type, description,
+                                 embedding, embedding_hash, embedding_model)
+        VALUES %s
+        ON CONFLICT (entity_name) DO UPDATE
+        SET description = COALESCE(EXCLUDED.description, graph_nodes.description),
+            embedding = COALESCE(EXCLUDED.embedding, graph_nodes.embedding),
+            embedding_hash = CASE WHEN EXCLUDED.embedding IS NULL
+                                  THEN graph_nodes.embedding_hash
+                                  ELSE EXCLUDED.embedding_hash END,
+            embedding_model = CASE WHEN EXCLUDED.embedding IS NULL
+                                   THEN graph_nodes.embedding_model
+                                   ELSE EXCLUDED.embedding_model END,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING id, entity_name
+    """, list(rows.values()), template='(%s, %s, %s, %s::vector, %s, %s)',
+        page_size=INGEST_PAGE_SIZE, fetch=True)
+
+    for node_id, name in returned:
+        entity_ids[name] = node_id
+    return entity_ids
+
+def edge_weight_update(mode):
+    """SQL combining an existing edge's weight with an incoming one (ON CONFLICT)"""
+    if mode == 'sum':
+        return "COALESCE(graph_edges.weight, 1.0) + COALESCE(EXCLUDED.weight, 1.0)"
+    if mode == 'max':
+        return "GREATEST(COALESCE(graph_edges.weight, 1.0), COALESCE(EXCLUDED.weight, 1.0))"
+    raise ValueError("edge_weight must be 'sum' or 'max'")
+
+def insert_edges(cur, relationships, entity_ids):
+    """Upsert relationships set-based on (source, target, relationship_type).
+
+    Endpoint names not in ``entity_ids`` are resolved with one query;
+    relationships whose endpoints don't exist are ignored. An edge that
+    already exists gets its mention_count incremented and its weight
+    combined per EDGE_WEIGHT_MODE, so repeated or concurrent ingests of
+    the same fact never create parallel edges. Returns a tuple of
+    (edges created, existing edges updated).
+    """
+    missing = {
+        name
+        for rel in relationships
+        for name in (rel['source'], rel['target'])
+        if name not in entity_ids
+    }
+    if missing:
+        cur.execute(
+            "SELECT id, entity_name FROM graph_nodes WHERE entity_name = ANY(%s)",
+            (list(missing),)
+        )
+        for node_id, name in cur.fetchall():
+            entity_ids[name] = node_id
+
+    # Fold repeats within the payload; one statement can't update a row twice
+    edges = {}
+    for rel in relationships:
+        source = entity_ids.get(rel['source'])
+        target = entity_ids.get(rel['target'])
+        if not (source and target):
+            continue
+        key = (source, target, rel.get('type', 'related_to'))
+        weight = float(rel['weight'] if rel.get('weight') is not None else 1.0)
+        if key in edges:
+            previous, mentions = edges[key]
+            weight = previous + weight if EDGE_WEIGHT_MODE == 'sum' else max(previous, weight)
+            edges[key] = (weight, mentions + 1)
+        else:
+            edges[key] = (weight, 1)
+
+    if not edges:
+        return 0, 0
+
+    rows = execute_values(cur, f"""
+        INSERT INTO graph_edges (source_node_id, target_node_id, relationship_type, weight, mention_count)
+        VALUES %s
+        ON CONFLICT (source_node_id, target_node_id, relationship_type) DO UPDATE
+        SET weight = {edge_weight_update(EDGE_WEIGHT_MODE)},
+            mention_count = graph_edges.mention_count + EXCLUDED.mention_count,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING source_node_id::text, target_node_id::text, relationship_type, mention_count
+    """, [
+        (source, target, rel_type, weight, mentions)
+        for (source, target, rel_type), (weight, mentions) in edges.items()
+    ], template='(%s::uuid, %s::uuid, %s, %s::float8, %s)',
+        page_size=INGEST_PAGE_SIZE, fetch=True)
+
+    # A row whose mention_count is just this payload's was newly inserted
+    created = sum(
+        1 for source, target, rel_type, mentions in rows
+        if edges[(str(source), str(target), rel_type)][1] == mentions
+    )
+    return created, len(rows) - created
+
+def notify_embedding_worker(conn):
+    """Wake embedding workers after committing nodes that still need vectors.
+
+    Best effort: if the server doesn't support NOTIFY the workers fall
+    back to polling, so errors are only logged.
+    """
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_notify(%s, '')", (EMBEDDING_NOTIFY_CHANNEL,))
+        cur.close()
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Embedding worker notify failed: {e}")
+
+class GraphSnapshot:
+    """Read-only in-memory copy of the graph for traversal without DB round trips.
+
+    Adjacency is kept twice (outgoing and incoming) in CSR form: int64
+    row pointers, int32 neighbour positions, int16 interned relationship
+    types and float32 weights, about 20 bytes per edge. Node UUIDs map to
+    positions through a sorted array of their 16 raw bytes; names, types
+    (interned) and PageRank are kept per position and embeddings, when
+    enabled, in one L2-normalised float32 matrix.
+
+    A snapshot is never modified once published, so request threads read
+    it without locks. refreshed() returns a new snapshot that shares the
+    bulk arrays and carries what changed since the watermark in small
+    overlay dicts (new and changed nodes, new edges, changed edge
+    weights); the maintenance thread then swaps the global reference.
+    New delta edges are folded into fresh CSR arrays once they pass 5% of
+    the edges. A large delta or overlay is replaced by a full load()
+    instead, which is also how deletions are picked up, so merges
+    request one. The interned type tables are only ever appended to and
+    are shared between snapshots.
+    """
+
+    OVERLAP = timedelta(seconds=60)
+    LOAD_BATCH = 50000
+
+    @classmethod
+    def load(cls, with_embeddings=True):
+        snap = cls()
+        snap.with_embeddings = with_embeddings
+        started = time.time()
+
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT LOCALTIMESTAMP")
+            snap.watermark = cur.fetchone()[0]
+            cur.close()
+
+            cur = conn.cursor(name=f'snapshot_nodes_{uuid.uuid4().hex}')
+            cur.itersize = cls.LOAD_BATCH
+            cur.execute(f"""
+                SELECT uuid_send(id), entity_name, entity_type, pagerank
+                       {', embedding::text' if with_embeddings else ''}
+                FROM graph_nodes
+            """)
+            uuid_buf, type_codes, pagerank = bytearray(), array('h'), array('f')
+            blocks, block = [], []
+            for row in cur:
+                uuid_buf += bytes(row[0])
+                snap.names.append(row[1])
+                type_codes.append(snap._intern(snap.types, snap.type_index, row[2] or 'Unknown'))
+                pagerank.append(row[3] or 0.0)
+                if with_embeddings:
+                    block.append(snap._parse_vector(row[4]))
+                    if len(block) == cls.LOAD_BATCH:
+                        blocks.append(np.vstack(block))
+                        block = []
+            cur.close()
+            snap.uuid_buf = bytes(uuid_buf)
+            snap.type_codes = np.array(type_codes, dtype=np.int16)
+            snap.pagerank = np.array(pagerank, dtype=np.float32)
+            if with_embeddings:
+                if block:
+                    blocks.append(np.vstack(block))
+                snap.embeddings = np.vstack(blocks) if blocks else np.zeros((0, 384), dtype=np.float32)
+                # Nodes without an embedding have an all-zero row
+                snap.has_embedding = snap.embeddings.any(axis=1)
+            keys = np.frombuffer(snap.uuid_buf, dtype='S16')
+            snap.sorted_pos = np.argsort(keys, kind='stable')
+            snap.sorted_keys = keys[snap.sorted_pos]
+
+            cur = conn.cursor(name=f'snapshot_edges_{uuid.uuid4().hex}')
+            cur.itersize = cls.LOAD_BATCH
+            cur.execute("""
+                SELECT uuid_send(source_node_id), uuid_send(target_node_id), relationship_type, weight
+                FROM graph_edges
+            """)
+            src_keys, dst_keys = bytearray(), bytearray()
+            rels, weights = array('h'), array('f')
+            for source, target, rel, weight in cur:
+                src_keys += bytes(source)
+                dst_keys += bytes(target)
+                rels.append(snap._intern(snap.rel_types, snap.rel_index, rel))
+                weights.append(weight if weight is not None else 1.0)
+            cur.close()
+            conn.rollback()
+
+        src = snap._positions(np.frombuffer(bytes(src_keys), dtype='S16'))
+        dst = snap._positions(np.frombuffer(bytes(dst_keys), dtype='S16'))
+        known = (src >= 0) & (dst >= 0)
+        snap._build_csr(
+            src[known], dst[known],
+            np.array(rels, dtype=np.int16)[known],
+            np.array(weights, dtype=np.float32)[known]
+        )
+        snap.loaded_at = snap.refreshed_at = time.time()
+        print(f"Graph snapshot loaded: {len(snap.names)} nodes, {snap.edge_count()} edges "
+              f"in {snap.loaded_at - started:.1f}s")
+        return snap
+
+    def __init__(self):
+        self.with_embeddings = False
+        self.watermark = None
+        self.loaded_at = None
+        self.refreshed_at = None
+        self.uuid_buf = b''
+        self.names = []
+        self.types, self.type_index = [], {}
+        self.type_codes = np.zeros(0, dtype=np.int16)
+        self.rel_types, self.rel_index = [], {}
+        self.pagerank = np.zeros(0, dtype=np.float32)
+        self.embeddings = None
+        self.has_embedding = None
+        self.sorted_pos = np.zeros(0, dtype=np.int64)
+        self.sorted_keys = np.zeros(0, dtype='S16')
+        # Overlay of rows changed since load(); replaced, never mutated, once published
+        self.new_keys, self.new_ids = {}, []
+        self.node_overrides = {}
+        self.pagerank_overrides = {}
+        self.vector_overrides = {}
+        self.delta_out, self.delta_in, self.delta_count = {}, {}, 0
+        self.weight_overrides = {}
+
+    @staticmethod
+    def _intern(values, index, value):
+        code = index.get(value)
+        if code is None:
+            values.append(value)
+            code = index[value] = len(values) - 1
+        return code
+
+    @staticmethod
+    def _parse_vector(text):
+        vector = np.zeros(384, dtype=np.float32)
+        if text:
+            vector = np.array(text.strip('[]').split(','), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector /= norm
+        return vector
+
+    def _positions(self, keys):
+        """Positions of raw UUID keys (-1 if unknown), vectorized"""
+        if len(self.sorted_keys) == 0:
+            pos = np.full(len(keys), -1, dtype=np.int64)
+        else:
+            i = np.minimum(np.searchsorted(self.sorted_keys, keys), len(self.sorted_keys) - 1)
+            pos = np.where(self.sorted_keys[i] == keys, self.sorted_pos[i], -1).astype(np.int64)
+        if self.new_keys:
+            for k in np.flatnonzero(pos < 0):
+                pos[k] = self.new_keys.get(self.uuid_key(keys[k]), -1)
+        return pos
+
+    @staticmethod
+    def uuid_key(value):
+        """Raw 16-byte key of a UUID string (numpy drops trailing NULs, so pad)"""
+        if isinstance(value, (bytes, np.bytes_)):
+            return bytes(value).ljust(16, b'\0')
+        return uuid.UUID(str(value)).bytes
+
+    def position(self, node_id):
+        key = self.uuid_key(node_id)
+        pos = self._positions(np.array([key], dtype='S16'))[0]
+        return int(pos) if pos >= 0 else None
+
+    def node_count(self):
+        return len(self.names) + len(self.new_ids)
+
+    def node_id(self, pos):
+        if pos < len(self.names):
+            return str(uuid.UUID(bytes=self.uuid_buf[16 * pos:16 * pos + 16]))
+        return str(uuid.UUID(bytes=self.new_ids[pos - len(self.names)]))
+
+    def name(self, pos):
+        node = self.node_overrides.get(pos)
+        return self.names[pos] if node is None else node[0]
+
+    def type_name(self, pos):
+        node = self.node_overrides.get(pos)
+        return self.types[self.type_codes[pos] if node is None else node[1]]
+
+    def node_pagerank(self, pos):
+        pr = self.pagerank_overrides.get(pos)
+        return float(self.pagerank[pos]) if pr is None else pr
+
+    def _build_csr(self, src, dst, rels, weights):
+        n = self.node_count()
+        self.csr_nodes = n
+        for prefix, rows, cols in (('out', src, dst), ('in', dst, src)):
+            order = np.argsort(rows, kind='stable')
+            ptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=n), out=ptr[1:])
+            setattr(self, f'{prefix}_ptr', ptr)
+            setattr(self, f'{prefix}_idx', cols[order].astype(np.int32))
+            setattr(self, f'{prefix}_rel', rels[order])
+            setattr(self, f'{prefix}_w', weights[order])
+        self.delta_out, self.delta_in, self.delta_count = {}, {}, 0
+        self.weight_overrides = {}
+
+    def edge_count(self):
+        return len(self.out_idx) + self.delta_count
+
+    def edges(self, pos, direction='out'):
+        """(neighbour, source, target, rel code, weight) tuples around a node"""
+        result = []
+        overrides = self.weight_overrides
+        if direction in ('out', 'both'):
+            if pos < self.csr_nodes:
+                a, b = self.out_ptr[pos], self.out_ptr[pos + 1]
+                for nbr, rel, w in zip(self.out_idx[a:b].tolist(), self.out_rel[a:b].tolist(),
+                                       self.out_w[a:b].tolist()):
+                    if overrides:
+                        w = overrides.get((pos, nbr, rel), w)
+                    result.append((nbr, pos, nbr, rel, w))
+            for nbr, rel, w in self.delta_out.get(pos, ()):
+                result.append((nbr, pos, nbr, rel, w))
+        if direction in ('in', 'both'):
+            if pos < self.csr_nodes:
+                a, b = self.in_ptr[pos], self.in_ptr[pos + 1]
+                for nbr, rel, w in zip(self.in_idx[a:b].tolist(), self.in_rel[a:b].tolist(),
+                                       self.in_w[a:b].tolist()):
+                    if overrides:
+                        w = overrides.get((nbr, pos, rel), w)
+                    result.append((nbr, nbr, pos, rel, w))
+            for nbr, rel, w in self.delta_in.get(pos, ()):
+                result.append((nbr, nbr, pos, rel, w))
+        return result
+
+    def positions(self, node_ids):
+        """Positions of node ids, or None if any is unknown to the snapshot"""
+        positions = []
+        for node_id in node_ids:
+            pos = self.position(node_id)
+            if pos is None:
+                return None
+            positions.append(pos)
+        return positions
+
+    def connections(self, node_ids, max_per_node=None, order='weight'):
+        """Same result as fetch_connections(), or None to fall back to SQL"""
+        positions = self.positions(node_ids)
+        if positions is None:
+            return None
+        connections = {}
+        for node_id, pos in zip(node_ids, positions):
+            edges = self.edges(pos, 'out')
+            if order == 'weight':
+                edges.sort(key=lambda e: e[4], reverse=True)
+            elif order == 'centrality':
+                edges.sort(key=lambda e: (self.node_pagerank(e[0]), e[4]), reverse=True)
+            connections[node_id] = [
+                {
+                    'name': self.name(nbr),
+                    'type': self.type_name(nbr),
+                    'rel': self.rel_types[rel],
+                    'weight': float(w)
+                }
+                for nbr, _, _, rel, w in edges[:max_per_node]
+            ]
+        return connections
+
+    def expand(self, seed_ids, hops=2, direction='both', rel_types=None,
+               min_weight=None, max_fanout=20, max_nodes=200, max_frontier=None):
+        """Breadth-first version of expand_graph()'s walk.
+
+        Returns (node id, name, type, depth, score, via) tuples ordered by
+        depth then score, or None if a seed is unknown to the snapshot.
+        Stops at the first depth that already fills ``max_nodes``, since
+        deeper nodes would rank below all of them.
+        """
+        if direction not in ('out', 'in', 'both'):
+            raise ValueError("direction must be 'out', 'in' or 'both'")
+        seeds = self.positions(seed_ids)
+        if seeds is None:
+            return None
+        max_frontier = max_frontier or max_nodes
+        rel_codes = None
+        if rel_types:
+            rel_codes = {self.rel_index[r] for r in rel_types if r in self.rel_index}
+        min_weight = float('-inf') if min_weight is None else min_weight
+
+        best = {pos: (0, 1.0, None) for pos in seeds}
+        frontier = {pos: 1.0 for pos in seeds}
+        for depth in range(1, hops + 1):
+            if len(best) >= max_nodes:
+                break
+            reached = {}
+            for pos, score in frontier.items():
+                candidates = [
+                    e for e in self.edges(pos, direction)
+                    if e[0] not in best and e[4] >= min_weight
+                    and (rel_codes is None or e[3] in rel_codes)
+                ]
+                candidates.sort(key=lambda e: e[4], reverse=True)
+                for nbr, source, target, rel, w in candidates[:max_fanout]:
+                    if nbr not in reached or score * w > reached[nbr][0]:
+                        reached[nbr] = (score * w, (source, target, rel, w))
+            if not reached:
+                break
+            for nbr, (score, via) in reached.items():
+                best[nbr] = (depth, score, via)
+            strongest = sorted(reached, key=lambda nbr: reached[nbr][0], reverse=True)[:max_frontier]
+            frontier = {nbr: reached[nbr][0] for nbr in strongest}
+
+        ranked = sorted(best.items(), key=lambda item: (item[1][0], -item[1][1]))[:max_nodes]
+        return [
+            (self.node_id(pos), self.name(pos), self.type_name(pos), depth, score, {
+                'source': self.name(via[0]),
+                'target': self.name(via[1]),
+                'rel': self.rel_types[via[2]],
+                'weight': float(via[3])
+            } if via else None)
+            for pos, (depth, score, via) in ranked
+        ]
+
+    def edges_among(self, node_ids):
+        """(source id, target id, rel, weight) for edges inside ``node_ids``, or None"""
+        positions = self.positions(node_ids)
+        if positions is None:
+            return None
+        members = set(positions)
+        return [
+            (self.node_id(source), self.node_id(target), self.rel_types[rel], w)
+            for pos in members
+            for _, source, target, rel, w in self.edges(pos, 'out')
+            if target in members
+        ]
+
+    def neighbourhood(self, node_ids, max_fanout):
+        """local_neighbourhood() rows around ``node_ids``, or None if one is unknown"""
+        positions = self.positions(node_ids)
+        if positions is None:
+            return None
+        result = []
+        for pos in positions:
+            edges = sorted(self.edges(pos, 'both'), key=lambda e: e[4], reverse=True)
+            for nbr, source, target, rel, weight in edges[:max_fanout]:
+                result.append((
+                    self.node_id(nbr),
+                    (self.node_id(source), self.node_id(target), self.rel_types[rel]),
+                    float(weight)
+                ))
+        return result
+
+    def nearest(self, query_embedding, limit):
+        """Exact cosine nearest neighbours: (node id, name, type, similarity)"""
+        if self.embeddings is None:
+            return []
+        query = np.array(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+
+        base = len(self.names)
+        similarity = np.zeros(self.node_count(), dtype=np.float32)
+        valid = np.zeros(self.node_count(), dtype=bool)
+        similarity[:base] = self.embeddings @ query
+        valid[:base] = self.has_embedding
+        for pos, vector in self.vector_overrides.items():
+            valid[pos] = vector is not None
+            similarity[pos] = vector @ query if vector is not None else 0.0
+
+        candidates = np.flatnonzero(valid)
+        if len(candidates) > limit:
+            top = np.argpartition(-similarity[candidates], limit - 1)[:limit]
+            candidates = candidates[top]
+        candidates = candidates[np.argsort(-similarity[candidates], kind='stable')]
+        return [
+            (self.node_id(pos), self.name(pos), self.type_name(pos), float(similarity[pos]))
+            for pos in candidates.tolist()
+        ]
+
+    def _delta_limit(self):
+        """Changed rows beyond which a full load() is cheaper than an overlay"""
+        return max(10000, self.node_count() // 20)
+
+    def _fetch_delta(self, conn, query, params, limit):
+        """Rows of ``query`` read in chunks through a named cursor; None past ``limit``"""
+        cur = conn.cursor(name=f'snapshot_delta_{uuid.uuid4().hex}')
+        cur.itersize = min(limit + 1, self.LOAD_BATCH)
+        cur.execute(query, params)
+        rows = []
+        for row in cur:
+            rows.append(row)
+            if len(rows) > limit:
+                rows = None
+                break
+        cur.close()
+        return rows
+
+    def refreshed(self):
+        """This snapshot plus the rows changed since its watermark.
+
+        Returns (snapshot, rows applied). The result is a new snapshot
+        (or a full load() when the change is too large to overlay); self
+        is left untouched for readers still holding it. PageRank, which
+        the centrality job updates for many nodes at once, is read on its
+        own as (id, pagerank) pairs via pagerank_updated_at.
+        """
+        since = self.watermark - self.OVERLAP
+        limit = self._delta_limit()
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT LOCALTIMESTAMP")
+            watermark = cur.fetchone()[0]
+            cur.close()
+            nodes = self._fetch_delta(conn, f"""
+                SELECT uuid_send(id), entity_name, entity_type, pagerank
+                       {', embedding::text' if self.with_embeddings else ''}
+                FROM graph_nodes
+                WHERE updated_at > %s
+            """, (since,), limit)
+            edges = pageranks = None
+            if nodes is not None:
+                edges = self._fetch_delta(conn, """
+                    SELECT uuid_send(source_node_id), uuid_send(target_node_id), relationship_type, weight
+                    FROM graph_edges
+                    WHERE updated_at > %s
+                """, (since,), limit)
+            if edges is not None:
+                pageranks = self._fetch_delta(conn, """
+                    SELECT uuid_send(id), pagerank
+                    FROM graph_nodes
+                    WHERE pagerank_updated_at > %s
+                """, (since,), self.node_count() + limit)
+            conn.rollback()
+
+        if pageranks is None:
+            print("Graph snapshot delta too large, reloading")
+            return GraphSnapshot.load(self.with_embeddings), limit
+
+        snap = copy.copy(self)
+        for attr in ('new_keys', 'node_overrides', 'pagerank_overrides', 'vector_overrides',
+                     'delta_out', 'delta_in', 'weight_overrides'):
+            setattr(snap, attr, dict(getattr(self, attr)))
+        snap.new_ids = list(self.new_ids)
+
+        for row in nodes:
+            snap._apply_node(bytes(row[0]), row[1], row[2], row[3],
+                             row[4] if self.with_embeddings else None)
+        for source, target, rel, weight in edges:
+            snap._apply_edge(bytes(source), bytes(target), rel,
+                             weight if weight is not None else 1.0)
+        if pageranks:
+            snap._apply_pageranks(pageranks)
+
+        if len(snap.node_overrides) > limit:
+            print("Graph snapshot overlay too large, reloading")
+            return GraphSnapshot.load(self.with_embeddings), len(nodes) + len(edges)
+        if snap.delta_count > max(10000, len(snap.out_idx) // 20):
+            snap._fold_edges()
+        snap.watermark = watermark
+        snap.refreshed_at = time.time()
+        return snap, len(nodes) + len(edges) + len(pageranks)
+
+    def _apply_node(self, key, name, typ, pagerank, embedding_text):
+        pos = self.position(key)
+        if pos is None:
+            pos = self.node_count()
+            self.new_keys[key] = pos
+            self.new_ids.append(key)
+        self.node_overrides[pos] = (name, self._intern(self.types, self.type_index, typ or 'Unknown'))
+        self.pagerank_overrides[pos] = pagerank or 0.0
+        if self.with_embeddings:
+            self.vector_overrides[pos] = self._parse_vector(embedding_text) if embedding_text else None
+
+    def _apply_edge(self, source_key, target_key, rel, weight):
+        source, target = self.position(source_key), self.position(target_key)
+        if source is None or target is None:
+            return
+        code = self._intern(self.rel_types, self.rel_index, rel)
+        if source < self.csr_nodes:
+            a, b = self.out_ptr[source], self.out_ptr[source + 1]
+            if np.any((self.out_idx[a:b] == target) & (self.out_rel[a:b] == code)):
+                self.weight_overrides[(source, target, code)] = weight
+                return
+        # Delta rows are tuples, replaced rather than changed in place
+        for prefix, row, col in (('out', source, target), ('in', target, source)):
+            delta = getattr(self, f'delta_{prefix}')
+            edges = [e for e in delta.get(row, ()) if not (e[0] == col and e[1] == code)]
+            if prefix == 'out' and len(edges) == len(delta.get(row, ())):
+                self.delta_count += 1
+            delta[row] = tuple(edges) + ((col, code, weight),)
+
+    def _apply_pageranks(self, rows):
+        """Take PageRank from (raw key, pagerank) rows; base values go into a new array"""
+        pagerank = self.pagerank.copy()
+        base = len(self.names)
+        for key, pr in rows:
+            pos = self.position(bytes(key))
+            if pos is None:
+                continue
+            if pos < base and pos not in self.pagerank_overrides:
+                pagerank[pos] = pr or 0.0
+            else:
+                self.pagerank_overrides[pos] = pr or 0.0
+        self.pagerank = pagerank
+
+    def _fold_edges(self):
+        """Rebuild (new) CSR arrays with the delta edges and weight changes folded in"""
+        rows = np.repeat(np.arange(self.csr_nodes, dtype=np.int64), np.diff(self.out_ptr))
+        weights = self.out_w.copy()
+        for (source, target, code), w in self.weight_overrides.items():
+            a, b = self.out_ptr[source], self.out_ptr[source + 1]
+            hit = np.flatnonzero((self.out_idx[a:b] == target) & (self.out_rel[a:b] == code))
+            if len(hit):
+                weights[a + hit[0]] = w
+        extra = [(row, col, rel, w) for row, edges in self.delta_out.items() for col, rel, w in edges]
+        self._build_csr(
+            np.concatenate([rows, np.array([e[0] for e in extra], dtype=np.int64)]),
+            np.concatenate([self.out_idx, np.array([e[1] for e in extra], dtype=np.int32)]),
+            np.concatenate([self.out_rel, np.array([e[2] for e in extra], dtype=np.int16)]),
+            np.concatenate([weights, np.array([e[3] for e in extra], dtype=np.float32)])
+        )
+
+    def stats(self):
+        arrays = [getattr(self, f'{p}_{a}') for p in ('out', 'in') for a in ('ptr', 'idx', 'rel', 'w')]
+        if self.embeddings is not None:
+            arrays.append(self.embeddings)
+        return {
+            'nodes': self.node_count(),
+            'edges': self.edge_count(),
+            'pending_delta_edges': self.delta_count,
+            'changed_nodes': len(self.node_overrides),
+            'relationship_types': len(self.rel_types),
+            'embeddings': self.with_embeddings,
+            'array_bytes': int(sum(a.nbytes for a in arrays)) + len(self.uuid_buf),
+            'loaded_at': self.loaded_at,
+            'refreshed_at': self.refreshed_at
+        }
+
+def maintain_graph_snapshot():
+    """Load the snapshot, then refresh it every GRAPH_SNAPSHOT_REFRESH seconds.
+
+    A full reload (which also drops deleted nodes and edges) happens
+    every GRAPH_SNAPSHOT_RELOAD seconds or when requested after merges.
+    Each load or refresh builds a new snapshot and publishes it by
+    swapping graph_snapshot; the previous one keeps serving until then.
+
+    Results computed from the snapshot may have been cached under a
+    graph version it hadn't caught up with yet, so the result cache is
+    cleared whenever the snapshot changes. The refresh overlap re-applies
+    recent rows once more, which also catches results cached while a
+    refresh was running.
+    """
+    global graph_snapshot, _snapshot_reload_requested
+    while True:
+        try:
+            if (graph_snapshot is None or _snapshot_reload_requested
+                    or time.time() - graph_snapshot.loaded_at > GRAPH_SNAPSHOT_RELOAD):
+                _snapshot_reload_requested = False
+                graph_snapshot = GraphSnapshot.load(GRAPH_SNAPSHOT_EMBEDDINGS)
+                clear_result_cache()
+            else:
+                graph_snapshot, changed = graph_snapshot.refreshed()
+                if changed:
+                    clear_result_cache()
+        except Exception as e:
+            print(f"Graph snapshot update failed: {e}")
+        time.sleep(GRAPH_SNAPSHOT_REFRESH)
+
+def start_graph_snapshot():
+    if GRAPH_SNAPSHOT:
+        threading.Thread(target=maintain_graph_snapshot, name='graph-snapshot', daemon=True).start()
+
+def request_snapshot_reload():
+    """Ask for a full snapshot reload, e.g. after nodes or edges were deleted"""
+    global _snapshot_reload_requested
+    _snapshot_reload_requested = True
+
+def node_descriptions(cur, node_ids):
+    """Descriptions of nodes by id (not held in the graph snapshot)"""
+    if not node_ids:
+        return {}
+    cur.execute(
+        "SELECT id, description FROM graph_nodes WHERE id = ANY(%s::uuid[])",
+        (list(node_ids),)
+    )
+    return {str(node_id): desc for node_id, desc in cur.fetchall()}
+
+CONNECTION_ORDERS = {
+    'weight': "ORDER BY e.weight DESC NULLS LAST",
+    'centrality': "ORDER BY n.pagerank DESC NULLS LAST, e.weight DESC NULLS LAST",
+    'none': ""
+}
+
+def fetch_connections(cur, node_ids, max_per_node=None, order='weight'):
+    """Fetch outgoing neighbours for many nodes in one round trip.
+
+    Uses a LATERAL join so each node's edges are read through
+    idx_edges_source and cut off at ``max_per_node`` (None = no cap).
+    ``order`` keeps the heaviest edges ('weight'), the most central
+    neighbours ('centrality') or any ('none') when the cap applies.
+    Returns a dict mapping node id to its list of connections.
+    """
+    connections = {node_id: [] for node_id in node_ids}
+    if not node_ids:
+        return connections
+
+    snap = graph_snapshot
+    if snap is not None:
+        cached = snap.connections(node_ids, max_per_node, order)
+        if cached is not None:
+            return cached
+
+    order = CONNECTION_ORDERS[order]
+    cur.execute(f"""
+        SELECT s.id, c.entity_name, c.entity_type, c.relationship_type, c.weight
+        FROM unnest(%s::uuid[]) WITH ORDINALITY AS s(id, pos)
+        CROSS JOIN LATERAL (
+            SELECT n.entity_name, n.entity_type, e.relationship_type, e.weight
+            FROM graph_edges e
+            JOIN graph_nodes n ON n.id = e.target_node_id
+            WHERE e.source_node_id = s.id
+            {order}
+            LIMIT %s
+        ) c
+        ORDER BY s.pos
+    """, (list(node_ids), max_per_node))
+
+    for node_id, name, typ, rel, weight in cur.fetchall():
+        connections[node_id].append({
+            'name': name,
+            'type': typ,
+            'rel': rel,
+            'weight': float(weight) if weight is not None else 1.0
+        })
+    return connections
+
+def connection_options(data):
+    """Read the neighbour cap/order options shared by the search endpoints"""
+    max_per_node = data.get('max_connections', MAX_CONNECTIONS_PER_NODE)
+    if not max_per_node or int(max_per_node) <= 0:
+        max_per_node = None
+    order = data.get('order_connections', 'weight')
+    if order not in CONNECTION_ORDERS:
+        order = 'none'
+    return max_per_node, order
+
+def expand_graph(cur, seed_ids, hops=2, direction='both', rel_types=None,
+                 min_weight=None, max_fanout=20, max_nodes=200, max_frontier=None):
+    """Breadth-first k-hop expansion from seed nodes, one query per hop.
+
+    ``direction`` is 'out', 'in' or 'both'. Each frontier node follows at
+    most ``max_fanout`` of its heaviest qualifying edges to nodes not
+    reached yet; edges lighter than ``min_weight`` or not in ``rel_types``
+    are pruned. Only the ``max_frontier`` (default ``max_nodes``) best
+    scoring new nodes go on to the next hop, so a hop reads at most
+    max_frontier * max_fanout edges, and the walk stops once ``max_nodes``
+    nodes are reached. Returns one row per reached node (its best path
+    at the shallowest depth), ordered by depth then score, where score is
+    the product of edge weights along the path.
+    """
+    if not seed_ids:
+        return []
+    if direction not in ('out', 'in', 'both'):
+        raise ValueError("direction must be 'out', 'in' or 'both'")
+    max_frontier = max_frontier or max_nodes
+
+    snap = graph_snapshot
+    walked = snap.expand(seed_ids, hops, direction, rel_types, min_weight,
+                         max_fanout, max_nodes, max_frontier) if snap is not None else None
+    if walked is not None:
+        descriptions = node_descriptions(cur, [w[0] for w in walked])
+        return [
+            {
+                'id': node_id,
+                'entity': name,
+                'type': typ,
+                'description': descriptions.get(node_id),
+                'depth': depth,
+                'score': float(score),
+                'via': via
+            }
+            for node_id, name, typ, depth, score, via in walked
+        ]
+
+    edge_filter = """
+        AND NOT %(neighbour)s = ANY(%(visited)s::uuid[])
+        AND (%(rel_types)s::text[] IS NULL OR e.relationship_type = ANY(%(rel_types)s::text[]))
+        AND COALESCE(e.weight, 1.0) >= %(min_weight)s
+    """
+    branches = []
+    if direction in ('out', 'both'):
+        branches.append("""
+            SELECT e.target_node_id AS node_id, e.source_node_id, e.target_node_id,
+                   e.relationship_type::text AS relationship_type, COALESCE(e.weight, 1.0) AS weight
+            FROM graph_edges e
+            WHERE e.source_node_id = f.id
+        """ + edge_filter.replace('%(neighbour)s', 'e.target_node_id'))
+    if direction in ('in', 'both'):
+        branches.append("""
+            SELECT e.source_node_id AS node_id, e.source_node_id, e.target_node_id,
+                   e.relationship_type::text AS relationship_type, COALESCE(e.weight, 1.0) AS weight
+            FROM graph_edges e
+            WHERE e.target_node_id = f.id
+        """ + edge_filter.replace('%(neighbour)s', 'e.source_node_id'))
+
+    # node id -> (depth, score, via edge)
+    best = {str(node_id): (0, 1.0, None) for node_id in seed_ids}
+    frontier = {node_id: 1.0 for node_id in best}
+    for depth in range(1, hops + 1):
+        if len(best) >= max_nodes:
+            break
+        cur.execute(f"""
+            SELECT f.score, c.node_id, c.source_node_id, c.target_node_id, c.relationship_type, c.weight
+            FROM unnest(%(frontier)s::uuid[], %(scores)s::float8[]) AS f(id, score)
+            CROSS JOIN LATERAL (
+                SELECT * FROM ({' UNION ALL '.join(branches)}) candidates
+                ORDER BY candidates.weight DESC
+                LIMIT %(max_fanout)s
+            ) c
+        """, {
+            'frontier': list(frontier),
+            'scores': list(frontier.values()),
+            'visited': list(best),
+            'rel_types': rel_types or None,
+            'min_weight': min_weight if min_weight is not None else float('-inf'),
+            'max_fanout': max_fanout
+        })
+        reached = {}
+        for score, node_id, source, target, rel, weight in cur.fetchall():
+            node_id, score = str(node_id), score * weight
+            if node_id not in reached or score > reached[node_id][0]:
+                reached[node_id] = (score, (str(source), str(target), rel, weight))
+        if not reached:
+            break
+        for node_id, (score, via) in reached.items():
+            best[node_id] = (depth, score, via)
+        # Only the strongest new nodes are expanded further
+        ranked = sorted(reached, key=lambda node_id: reached[node_id][0], reverse=True)
+        frontier = {node_id: reached[node_id][0] for node_id in ranked[:max_frontier]}
+
+    ranked = sorted(best.items(), key=lambda item: (item[1][0], -item[1][1]))[:max_nodes]
+    names = {node_id for node_id, _ in ranked}
+    names.update(end for _, (_, _, via) in ranked if via for end in via[:2])
+    cur.execute(
+        "SELECT id, entity_name, entity_type, description FROM graph_nodes WHERE id = ANY(%s::uuid[])",
+        (list(names),)
+    )
+    nodes = {str(node_id): (name, typ, desc) for node_id, name, typ, desc in cur.fetchall()}
+
+    return [
+        {
+            'id': node_id,
+            'entity': nodes[node_id][0],
+            'type': nodes[node_id][1],
+            'description': nodes[node_id][2],
+            'depth': depth,
+            'score': float(score),
+            'via': {
+                'source': nodes.get(via[0], (None,))[0],
+                'target': nodes.get(via[1], (None,))[0],
+                'rel': via[2],
+                'weight': float(via[3])
+            } if via else None
+        }
+        for node_id, (depth, score, via) in ranked
+        if node_id in nodes
+    ]
+
+def expand_options(data):
+    """Read the traversal options shared by /graph/expand and semantic-search"""
+    return {
+        'hops': max(0, min(int(data.get('hops', 2)), MAX_EXPAND_HOPS)),
+        'direction': data.get('direction', 'both'),
+        'rel_types': data.get('rel_types'),
+        'min_weight': data.get('min_weight'),
+        'max_fanout': int(data.get('max_fanout', 20)),
+        'max_nodes': int(data.get('max_nodes', 200)),
+        'max_frontier': int(data['max_frontier']) if data.get('max_frontier') else None
+    }
+
+def local_neighbourhood(cur, frontier, max_fanout):
+    """The ``max_fanout`` heaviest edges, in either direction, around each frontier node.
+
+    Returns (neighbour id, (source, target, rel), weight) tuples; the
+    middle element identifies the edge, so callers can de-duplicate
+    edges reached from both ends. Served by the graph snapshot when it
+    knows every frontier node.
+    """
+    snap = graph_snapshot
+    cached = snap.neighbourhood(frontier, max_fanout) if snap is not None else None
+    if cached is not None:
+        return cached
+
+    cur.execute("""
+        SELECT c.node_id, c.source_node_id, c.target_node_id, c.relationship_type, c.weight
+        FROM unnest(%s::uuid[]) AS f(id)
+        CROSS JOIN LATERAL (
+            SELECT * FROM (
+                SELECT e.target_node_id AS node_id, e.source_node_id, e.target_node_id,
+                       e.relationship_type, COALESCE(e.weight, 1.0) AS weight
+                FROM graph_edges e
+                WHERE e.source_node_id = f.id
+                UNION ALL
+                SELECT e.source_node_id, e.source_node_id, e.target_node_id,
+                       e.relationship_type, COALESCE(e.weight, 1.0)
+                FROM graph_edges e
+                WHERE e.target_node_id = f.id
+            ) candidates
+            ORDER BY candidates.weight DESC
+            LIMIT %s
+        ) c
+    """, (list(frontier), max_fanout))
+    return [
+        (str(nbr), (str(source), str(target), rel), float(weight))
+        for nbr, source, target, rel, weight in cur.fetchall()
+    ]
+
+def personalized_pagerank(cur, seeds, restart=0.15, hops=2, max_fanout=50, max_nodes=2000,
+                          time_budget_ms=200, limit=10, tol=1e-4, max_iter=100):
+    """Rank context nodes around ``seeds`` by Personalized PageRank.
+
+    ``seeds`` maps node id to its restart weight (e.g. vector
+    similarity). The walk runs on a local subgraph: up to ``hops`` rings
+    of neighbours, each node contributing at most its ``max_fanout``
+    heaviest edges, and at most ``max_nodes`` nodes, so hubs can't blow
+    up the work. Edges are treated as undirected and weighted; the
+    iteration is vectorized with bincount and stops at convergence,
+    ``max_iter`` or the time budget. Returns the ``limit`` best
+    non-seed nodes and run statistics.
+    """
+    started = time.time()
+    deadline = started + time_budget_ms / 1000.0
+
+    index = {node_id: i for i, node_id in enumerate(seeds)}
+    edges = {}
+    frontier = list(seeds)
+    for _ in range(hops):
+        if not frontier or len(index) >= max_nodes or time.time() > deadline:
+            break
+        reached = []
+        for nbr, key, weight in local_neighbourhood(cur, frontier, max_fanout):
+            if nbr not in index:
+                if len(index) >= max_nodes:
+                    continue
+                index[nbr] = len(index)
+                reached.append(nbr)
+            edges[key] = weight
+        frontier = reached
+
+    n = len(index)
+    kept = [(index[s], index[t], w) for (s, t, _), w in edges.items() if s in index and t in index]
+    src = np.array([e[0] for e in kept], dtype=np.int64)
+    dst = np.array([e[1] for e in kept], dtype=np.int64)
+    weights = np.maximum(np.array([e[2] for e in kept], dtype=np.float64), 0.0)
+
+    # Undirected: every edge can be walked both ways
+    rows = np.concatenate([src, dst])
+    cols = np.concatenate([dst, src])
+    weights = np.concatenate([weights, weights])
+    out_weight = np.bincount(rows, weights=weights, minlength=n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        transition = np.where(out_weight[rows] > 0, weights / out_weight[rows], 0.0)
+    dangling = out_weight == 0
+
+    personalization = np.zeros(n)
+    for node_id, weight in seeds.items():
+        personalization[index[node_id]] = max(float(weight), 0.0)
+    if personalization.sum() == 0:
+        personalization[:len(seeds)] = 1.0
+    personalization /= personalization.sum()
+
+    rank = personalization.copy()
+    iterations, converged = 0, False
+    for iterations in range(1, max_iter + 1):
+        # bincount of an empty edge list is int64; keep the sum in floats
+        spread = np.bincount(cols, weights=rank[rows] * transition, minlength=n).astype(np.float64)
+        # Walkers stuck on nodes without local edges restart at the seeds
+        spread += rank[dangling].sum() * personalization
+        new_rank = (1.0 - restart) * spread + restart * personalization
+        delta = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if delta < tol:
+            converged = True
+            break
+        if time.time() > deadline:
+            break
+
+    candidates = [i for i in np.argsort(-rank, kind='stable').tolist() if i >= len(seeds)][:limit]
+    ids = list(index)
+    top = [(ids[i], float(rank[i])) for i in candidates]
+
+    details = {}
+    if top:
+        cur.execute(
+            "SELECT id, entity_name, entity_type, description FROM graph_nodes WHERE id = ANY(%s::uuid[])",
+            ([node_id for node_id, _ in top],)
+        )
+        details = {str(r[0]): r[1:] for r in cur.fetchall()}
+
+    context = [
+        {
+            'entity': details[node_id][0],
+            'type': details[node_id][1],
+            'description': details[node_id][2],
+            'score': score
+        }
+        for node_id, score in top if node_id in details
+    ]
+    return context, {
+        'subgraph_nodes': n,
+        'subgraph_edges': len(kept),
+        'iterations': iterations,
+        'converged': converged,
+        'elapsed_ms': round((time.time() - started) * 1000, 1)
+    }
+
+def ppr_options(data):
+    """Read the Personalized PageRank options of semantic-search"""
+    return {
+        'restart': float(data.get('ppr_restart', 0.15)),
+        'hops': max(1, min(int(data.get('ppr_hops', 2)), MAX_EXPAND_HOPS)),
+        'max_fanout': int(data.get('ppr_max_fanout', 50)),
+        'max_nodes': int(data.get('ppr_max_nodes', 2000)),
+        'time_budget_ms': float(data.get('ppr_time_budget_ms', 200)),
+        'limit': int(data.get('context_limit', 10))
+    }
+
+def apply_vector_search_options(cur, data):
+    """Apply per-request ANN knobs for the current transaction.
+
+    ``ef_search`` (HNSW) and ``probes`` (IVFFlat) trade recall for latency;
+    ``exact`` disables index scans so the query falls back to an exact
+    sequential scan. Uses set_config(..., true) so settings never leak to
+    the next user of a pooled connection.
+    """
+    if data.get('exact'):
+        cur.execute("SELECT set_config('enable_indexscan', 'off', true)")
+        return
+    if data.get('ef_search') is not None:
+        cur.execute(
+            "SELECT set_config(%s, %s, true)",
+            (f'{VECTOR_INDEX_METHOD}.ef_search', str(int(data['ef_search'])))
+        )
+    if data.get('probes') is not None:
+        cur.execute("SELECT set_config('ivfflat.probes', %s, true)", (str(int(data['probes'])),))
+
+def get_vector_index_status(cur):
+    """Describe the ANN index on graph_nodes.embedding, if any"""
+    cur.execute("""
+        SELECT indexname, indexdef
+        FROM pg_indexes
+        WHERE tablename = 'graph_nodes' AND indexname = %s
+    """, (VECTOR_INDEX_NAME,))
+    row = cur.fetchone()
+    if not row:
+        return {'exists': False, 'name': VECTOR_INDEX_NAME}
+    return {'exists': True, 'name': row[0], 'definition': row[1]}
+
+def build_tsquery(text, prefix=True, match='all'):
+    """Turn free text into a to_tsquery() expression.
+
+    Words are reduced to alphanumeric tokens so user input can never
+    produce tsquery syntax errors. With ``prefix`` every token matches as
+    a prefix ("yuga" finds "yugabytedb"). Returns None if nothing is
+    left to search for.
+    """
+    tokens = re.findall(r'\w+', (text or '').lower())
+    if not tokens:
+        return None
+    suffix = ':*' if prefix else ''
+    joiner = ' | ' if match == 'any' else ' & '
+    return joiner.join(f'{t}{suffix}' for t in tokens)
+
+def keyword_search(cur, query, limit=3, prefix=True, match='all'):
+    """Ranked full-text search over entity names and descriptions.
+
+    Served by the GIN index on graph_nodes.search_vector. Exact name
+    matches come first, then ts_rank_cd relevance (names are weighted
+    above descriptions). Returns (id, name, type, description, rank) rows.
+    """
+    tsquery = build_tsquery(query, prefix, match)
+    if tsquery is None:
+        return []
+
+    cur.execute("""
+        SELECT id, entity_name, entity_type, description,
+               ts_rank_cd(search_vector, q) AS rank
+        FROM graph_nodes, to_tsquery('simple', %s) AS q
+        WHERE search_vector @@ q
+        ORDER BY LOWER(entity_name) = LOWER(%s) DESC, rank DESC
+        LIMIT %s
+    """, (tsquery, query.strip(), limit))
+    return cur.fetchall()
+
+def vector_search(cur, query_embedding, limit):
+    """Nearest neighbours by cosine distance.
+
+    Returns (id, name, type, description, similarity) rows. With an
+    embedding snapshot loaded this is an exact in-memory scan instead.
+    """
+    snap = graph_snapshot
+    if snap is not None and snap.with_embeddings:
+        hits = snap.nearest(query_embedding, limit)
+        descriptions = node_descriptions(cur, [h[0] for h in hits])
+        return [(node_id, name, typ, descriptions.get(node_id), similarity)
+                for node_id, name, typ, similarity in hits]
+
+    cur.execute("""
+        SELECT 
+            id,
+            entity_name,
+            entity_type,
+            description,
+            1 - (embedding <=> %s::vector) as similarity
+        FROM graph_nodes
+        WHERE embedding IS NOT NULL
+        ORDER BY embedding <=> %s::vector
+        LIMIT %s
+    """, (query_embedding, query_embedding, limit))
+    return cur.fetchall()
+
+def vector_search_many(cur, query_embeddings, limit):
+    """Nearest neighbours for several query vectors in one round trip.
+
+    Each vector gets its own ANN lookup through a LATERAL join over
+    unnest(), so the index is still used per query. Returns a list of
+    (id, name, type, description, similarity) row lists aligned with
+    ``query_embeddings``.
+    """
+    if not query_embeddings:
+        return []
+
+    snap = graph_snapshot
+    if snap is not None and snap.with_embeddings:
+        hits = [snap.nearest(e, limit) for e in query_embeddings]
+        descriptions = node_descriptions(cur, {h[0] for rows in hits for h in rows})
+        return [
+            [(node_id, name, typ, descriptions.get(node_id), similarity)
+             for node_id, name, typ, similarity in rows]
+            for rows in hits
+        ]
+
+    # Vectors travel as text literals; a list of lists would become a 2-D array
+    literals = ['[' + ','.join(map(str, e)) + ']' for e in query_embeddings]
+    cur.execute("""
+        SELECT q.pos, h.id, h.entity_name, h.entity_type, h.description, h.similarity
+        FROM unnest(%s::text[]) WITH ORDINALITY AS q(vec, pos)
+        CROSS JOIN LATERAL (
+            SELECT id, entity_name, entity_type, description,
+                   1 - (embedding <=> q.vec::vector) AS similarity
+            FROM graph_nodes
+            WHERE embedding IS NOT NULL
+            ORDER BY embedding <=> q.vec::vector
+            LIMIT %s
+        ) h
+        ORDER BY q.pos, h.similarity DESC
+    """, (literals, limit))
+
+    results = [[] for _ in query_embeddings]
+    for pos, *row in cur.fetchall():
+        results[pos - 1].append(tuple(row))
+    return results
+
+def _vector_candidates(query, limit, data):
+    """Vector candidate generator for hybrid search (own connection)"""
+    query_embedding = get_query_embedding(query)
+    if not query_embedding:
+        return []
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        apply_vector_search_options(cur, data)
+        rows = vector_search(cur, query_embedding, limit)
+        cur.close()
+    return rows
+
+def _keyword_candidates(query, limit, data):
+    """Keyword candidate generator for hybrid search (own connection)"""
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        rows = keyword_search(cur, query, limit, prefix=True, match=data.get('match', 'any'))
+        cur.close()
+    return rows
+
+def fuse_rankings(rankings, weights, method='rrf', rrf_k=60):
+    """Combine ranked candidate lists into one score per node id.
+
+    ``rankings`` maps a source name to a list of (node_id, raw_score) in
+    rank order. 'rrf' sums weight / (rrf_k + rank); 'weighted' sums
+    weight * raw_score normalised by the list's best score.
+    """
+    fused = {}
+    for source, ranked in rankings.items():
+        weight = weights.get(source, 1.0)
+        best = max((score for _, score in ranked), default=0) or 1.0
+        for rank, (node_id, score) in enumerate(ranked, start=1):
+            if method == 'weighted':
+                contribution = weight * (score / best)
+            else:
+                contribution = weight / (rrf_k + rank)
+            fused[node_id] = fused.get(node_id, 0.0) + contribution
+    return fused
+
+def centrality_boost(cur, scores, weight, include=False):
+    """Add ``weight`` * PageRank, scaled to the best candidate, to each score.
+
+    ``scores`` maps node id to its relevance score and is updated in
+    place. Returns the candidates' PageRank by node id (0 until computed).
+    Without a weight the lookup is skipped, and {} returned, unless
+    ``include`` asks for the values anyway.
+    """
+    if not scores or not (weight or include):
+        return {}
+    cur.execute(
+        "SELECT id, COALESCE(pagerank, 0) FROM graph_nodes WHERE id = ANY(%s::uuid[])",
+        (list(scores),)
+    )
+    pagerank = {node_id: float(pr) for node_id, pr in cur.fetchall()}
+    best = max(pagerank.values(), default=0) or 1.0
+    if weight:
+        for node_id in scores:
+            scores[node_id] += weight * pagerank.get(node_id, 0.0) / best
+    return pagerank
+
+def bump_graph_version(cur):
+    """Advance the graph version inside the caller's write transaction.
+
+    Call just before commit, then pass the result to
+    mark_graph_changed() once the commit succeeded.
+    """
+    cur.execute("UPDATE graph_meta SET version = version + 1 WHERE id = 1 RETURNING version")
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def mark_graph_changed(version):
+    """Record a committed write so cached results are dropped immediately"""
+    global _graph_version, _graph_version_checked
+    with _result_cache_lock:
+        if version is None:
+            # No graph_meta row: fall back to a process-local bump
+            version = (_graph_version or 0) + 1
+        _graph_version = max(version, _graph_version or 0)
+        _graph_version_checked = time.time()
+
+def current_graph_version():
+    """Graph version, re-read from the database at most every
+    RESULT_CACHE_VERSION_CHECK seconds so writes from other workers
+    (or the embedding worker) also invalidate cached results.
+    """
+    global _graph_version, _graph_version_checked
+    if time.time() - _graph_version_checked < RESULT_CACHE_VERSION_CHECK:
+        return _graph_version
+    try:
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT version FROM graph_meta WHERE id = 1")
+            row = cur.fetchone()
+            cur.close()
+    except Exception as e:
+        print(f"Graph version check failed: {e}")
+        return None
+    with _result_cache_lock:
+        if row is not None:
+            _graph_version = max(row[0], _graph_version or 0)
+        _graph_version_checked = time.time()
+    return _graph_version
+
+def cached_result(endpoint):
+    """Cache successful JSON responses of a read endpoint.
+
+    Keyed on the endpoint plus its JSON body / query string, and only
+    served while the graph version is unchanged and the entry is younger
+    than RESULT_CACHE_TTL.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if RESULT_CACHE_SIZE <= 0:
+                return view(*args, **kwargs)
+
+            params = request.get_json(silent=True) if request.method == 'POST' else request.args.to_dict()
+            key = (endpoint, json.dumps(params, sort_keys=True, default=str))
+            version = current_graph_version()
+            now = time.time()
+
+            if version is not None:
+                with _result_cache_lock:
+                    entry = _result_cache.get(key)
+                    if entry is not None and entry[0] == version and entry[1] > now:
+                        _result_cache.move_to_end(key)
+                        result_cache_stats['hits'] += 1
+                        response = jsonify(entry[2])
+                        response.headers['X-Cache'] = 'HIT'
+                        return response
+
+            result_cache_stats['misses'] += 1
+            response = view(*args, **kwargs)
+            if (version is None or isinstance(response, tuple)
+                    or response.status_code != 200 or response.is_streamed):
+                return response
+
+            with _result_cache_lock:
+                _result_cache[key] = (version, now + RESULT_CACHE_TTL, response.get_json())
+                _result_cache.move_to_end(key)
+                while len(_result_cache) > RESULT_CACHE_SIZE:
+                    _result_cache.popitem(last=False)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+def clear_result_cache():
+    """Drop every cached response, e.g. when the graph snapshot changed"""
+    with _result_cache_lock:
+        _result_cache.clear()
+
+def get_result_cache_stats():
+    """Result cache usage for /health"""
+    return {
+        'size': len(_result_cache),
+        'max_size': RESULT_CACHE_SIZE,
+        'ttl_seconds': RESULT_CACHE_TTL,
+        'graph_version': _graph_version,
+        **result_cache_stats
+    }
+
+def start_background_job(kind, target, *args):
+    """Run ``target(progress, *args)`` on a daemon thread.
+
+    ``progress`` is a dict the target updates as it goes; it is exposed
+    together with the result (or error) through GET /jobs/<id>.
+    """
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'status': 'running',
+        'progress': {},
+        'result': None,
+        'error': None,
+        'started_at': time.time(),
+        'finished_at': None
+    }
+
+    def run():
+        try:
+            job['result'] = target(job['progress'], *args)
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        job['finished_at'] = time.time()
+
+    with _jobs_lock:
+        _jobs[job['id']] = job
+        # Forget the oldest finished jobs beyond MAX_FINISHED_JOBS
+        finished = [j for j in _jobs.values() if j['status'] != 'running']
+        for old in sorted(finished, key=lambda j: j['started_at'])[:-MAX_FINISHED_JOBS]:
+            del _jobs[old['id']]
+
+    threading.Thread(target=run, name=f'job-{kind}', daemon=True).start()
+    return job
+
+def merge_duplicate_nodes(progress, batch_size, edge_weight='sum', pairs=None):
+    """Merge duplicate nodes into their keepers, in bounded batches.
+
+    By default duplicates are nodes whose names differ only by case, and
+    the earliest created node of each LOWER(entity_name) group is kept.
+    Alternatively ``pairs`` supplies explicit (loser, keeper) ids.
+
+    A temp table maps every loser to its keeper; each batch of
+    ``batch_size`` losers is then merged in its own transaction: edges
+    are re-pointed at the keepers in bulk, edges that become parallel
+    are folded into one per (source, target, relationship_type) key
+    (weights summed or maxed, mention counts added), self-references
+    dropped and the losers deleted. Pairs whose keeper no longer exists
+    are skipped.
+    """
+    if edge_weight not in ('sum', 'max'):
+        raise ValueError("edge_weight must be 'sum' or 'max'")
+    weight_agg = 'SUM' if edge_weight == 'sum' else 'MAX'
+
+    totals = {'entities_merged': 0, 'self_references_removed': 0,
+              'parallel_edges_collapsed': 0, 'pairs_skipped': 0, 'batches': 0}
+
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DROP TABLE IF EXISTS dedup_map")
+        cur.execute("CREATE TEMP TABLE dedup_map (loser UUID PRIMARY KEY, keeper UUID NOT NULL)")
+        if pairs is None:
+            cur.execute("""
+                INSERT INTO dedup_map (loser, keeper)
+                SELECT id, keeper
+                FROM (
+                    SELECT id,
+                           FIRST_VALUE(id) OVER w AS keeper,
+                           COUNT(*) OVER (PARTITION BY LOWER(entity_name)) AS group_size
+                    FROM graph_nodes
+                    WINDOW w AS (PARTITION BY LOWER(entity_name) ORDER BY created_at, id)
+                ) g
+                WHERE group_size > 1 AND id <> keeper
+            """)
+            progress['duplicates_found'] = cur.rowcount
+        else:
+            execute_values(cur, """
+                INSERT INTO dedup_map (loser, keeper) VALUES %s
+                ON CONFLICT (loser) DO NOTHING
+            """, pairs, template='(%s::uuid, %s::uuid)', page_size=INGEST_PAGE_SIZE)
+            progress['duplicates_found'] = len(pairs)
+        progress['entities_merged'] = 0
+        conn.commit()
+
+        try:
+            while True:
+                cur.execute("""
+                    SELECT d.loser, d.keeper, n.id IS NOT NULL
+                    FROM dedup_map d
+                    LEFT JOIN graph_nodes n ON n.id = d.keeper AND d.keeper <> d.loser
+                    ORDER BY d.loser
+                    LIMIT %s
+                """, (batch_size,))
+                batch = cur.fetchall()
+                if not batch:
+                    break
+
+                # Keepers deleted since the pairs were chosen (or merged away
+                # by an earlier batch) would fail the edges' foreign key
+                orphans = [r[0] for r in batch if not r[2]]
+                if orphans:
+                    cur.execute("DELETE FROM dedup_map WHERE loser = ANY(%s::uuid[])", (orphans,))
+                    totals['pairs_skipped'] += len(orphans)
+                    batch = [r for r in batch if r[2]]
+                    if not batch:
+                        conn.commit()
+                        progress.update(totals)
+                        continue
+                losers = [r[0] for r in batch]
+                keepers = [r[1] for r in batch]
+
+                # Re-point the losers' edges at their keepers, folding edges
+                # that become parallel into one row per edge key
+                cur.execute(f"""
+                    CREATE TEMP TABLE dedup_edges ON COMMIT DROP AS
+                    SELECT COALESCE(ms.keeper, e.source_node_id) AS source_node_id,
+                           COALESCE(mt.keeper, e.target_node_id) AS target_node_id,
+                           e.relationship_type,
+                           {weight_agg}(COALESCE(e.weight, 1.0)) AS weight,
+                           SUM(e.mention_count) AS mention_count,
+                           (array_agg(e.properties ORDER BY e.created_at, e.id))[1] AS properties,
+                           MIN(e.created_at) AS created_at,
+                           COUNT(*) AS edges
+                    FROM graph_edges e
+                    LEFT JOIN unnest(%(losers)s::uuid[], %(keepers)s::uuid[]) AS ms(loser, keeper)
+                           ON e.source_node_id = ms.loser
+                    LEFT JOIN unnest(%(losers)s::uuid[], %(keepers)s::uuid[]) AS mt(loser, keeper)
+                           ON e.target_node_id = mt.loser
+                    WHERE e.source_node_id = ANY(%(losers)s::uuid[])
+                       OR e.target_node_id = ANY(%(losers)s::uuid[])
+                    GROUP BY 1, 2, 3
+                """, {'losers': losers, 'keepers': keepers})
+                cur.execute("""
+                    DELETE FROM graph_edges
+                    WHERE source_node_id = ANY(%(losers)s::uuid[])
+                       OR target_node_id = ANY(%(losers)s::uuid[])
+                """, {'losers': losers})
+
+                cur.execute("SELECT COALESCE(SUM(edges), 0) FROM dedup_edges WHERE source_node_id = target_node_id")
+                totals['self_references_removed'] += int(cur.fetchone()[0])
+                cur.execute("DELETE FROM dedup_edges WHERE source_node_id = target_node_id")
+
+                # Parallel edges: folded within the batch, or landing on a keeper's edge
+                cur.execute("""
+                    SELECT COALESCE(SUM(d.edges - 1), 0)
+                         + COUNT(*) FILTER (WHERE EXISTS (
+                               SELECT 1 FROM graph_edges e
+                               WHERE e.source_node_id = d.source_node_id
+                                 AND e.target_node_id = d.target_node_id
+                                 AND e.relationship_type = d.relationship_type))
+                    FROM dedup_edges d
+                """)
+                totals['parallel_edges_collapsed'] += int(cur.fetchone()[0])
+
+                cur.execute(f"""
+                    INSERT INTO graph_edges (source_node_id, target_node_id, relationship_type,
+                                             weight, mention_count, properties, created_at)
+                    SELECT source_node_id, target_node_id, relationship_type,
+                           weight, mention_count, properties, created_at
+                    FROM dedup_edges
+                    ON CONFLICT (source_node_id, target_node_id, relationship_type) DO UPDATE
+                    SET weight = {edge_weight_update(edge_weight)},
+                        mention_count = graph_edges.mention_count + EXCLUDED.mention_count,
+                        created_at = LEAST(graph_edges.created_at, EXCLUDED.created_at),
+                        updated_at = CURRENT_TIMESTAMP
+                """)
+
+                cur.execute("DELETE FROM graph_nodes WHERE id = ANY(%s::uuid[])", (losers,))
+                totals['entities_merged'] += cur.rowcount
+                cur.execute("DELETE FROM dedup_map WHERE loser = ANY(%s::uuid[])", (losers,))
+
+                version = bump_graph_version(cur)
+                conn.commit()
+                mark_graph_changed(version)
+
+                totals['batches'] += 1
+                progress.update(totals)
+
+            # Self-references that existed before the merge
+            cur.execute("DELETE FROM graph_edges WHERE source_node_id = target_node_id")
+            if cur.rowcount:
+                totals['self_references_removed'] += cur.rowcount
+                version = bump_graph_version(cur)
+                conn.commit()
+                mark_graph_changed(version)
+        finally:
+            conn.rollback()
+            cur.execute("DROP TABLE IF EXISTS dedup_map")
+            conn.commit()
+            cur.close()
+
+    progress.update(totals)
+    if totals['entities_merged']:
+        schedule_centrality_refresh()
+        request_snapshot_reload()
+    return totals
+
+def load_graph_arrays(node_columns=()):
+    """Stream the whole graph into arrays for in-process graph algorithms.
+
+    Returns (ids, columns, src, dst, weights): ``ids`` lists node ids by
+    position, ``columns`` holds one list per requested graph_nodes column
+    in the same order, and src/dst (int64 positions) and weights
+    (float64, negatives clipped to 0) describe every edge. Both tables
+    are read through server-side cursors.
+    """
+    select = ', '.join(('id',) + tuple(node_columns))
+    with get_db_connection() as conn:
+        cur = conn.cursor(name=f'graph_nodes_{uuid.uuid4().hex}')
+        cur.itersize = 50000
+        cur.execute(f"SELECT {select} FROM graph_nodes")
+        ids = []
+        columns = [[] for _ in node_columns]
+        for row in cur:
+            ids.append(row[0])
+            for values, value in zip(columns, row[1:]):
+                values.append(value)
+        cur.close()
+
+        index = {node_id: i for i, node_id in enumerate(ids)}
+        src, dst, weights = array('q'), array('q'), array('d')
+        cur = conn.cursor(name=f'graph_edges_{uuid.uuid4().hex}')
+        cur.itersize = 50000
+        cur.execute("SELECT source_node_id, target_node_id, weight FROM graph_edges")
+        for source, target, weight in cur:
+            if source in index and target in index:
+                src.append(index[source])
+                dst.append(index[target])
+                weights.append(max(weight if weight is not None else 1.0, 0.0))
+        cur.close()
+        conn.rollback()
+
+    return (
+        ids, columns,
+        np.array(src, dtype=np.int64),
+        np.array(dst, dtype=np.int64),
+        np.array(weights, dtype=np.float64)
+    )
+
+def compute_centrality(progress, damping=CENTRALITY_DAMPING, max_iter=100, tol=1e-6):
+    """Recompute degree and weighted PageRank for every node.
+
+    Nodes and edges are streamed into numpy arrays; PageRank is a
+    vectorized power iteration over the edge list (bincount as the
+    sparse matrix-vector product), warm-started from the stored scores
+    so refreshes after small ingests converge in a few iterations. Only
+    nodes whose degree changed or whose PageRank moved by more than
+    0.1% are written back, CENTRALITY_WRITE_BATCH per transaction.
+    """
+    ids, (old_degree, old_pagerank), src, dst, weights = load_graph_arrays(['degree', 'pagerank'])
+
+    n = len(ids)
+    progress.update({'nodes': n, 'edges': len(src)})
+    if n == 0:
+        return {'nodes': 0, 'edges': 0, 'iterations': 0, 'nodes_updated': 0}
+
+    old_degree = [d or 0 for d in old_degree]
+    old_pagerank = [pr if pr is not None else np.nan for pr in old_pagerank]
+
+    degree = np.bincount(src, minlength=n) + np.bincount(dst, minlength=n)
+
+    out_weight = np.bincount(src, weights=weights, minlength=n)
+    dangling = out_weight == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        transition = np.where(out_weight[src] > 0, weights / out_weight[src], 0.0)
+
+    old_pagerank = np.array(old_pagerank, dtype=np.float64)
+    rank = np.where(np.isnan(old_pagerank), 1.0 / n, old_pagerank)
+    rank /= rank.sum()
+
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        spread = np.bincount(dst, weights=rank[src] * transition, minlength=n)
+        new_rank = damping * (spread + rank[dangling].sum() / n) + (1.0 - damping) / n
+        delta = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if delta < tol:
+            break
+    progress['iterations'] = iterations
+
+    changed = np.flatnonzero(
+        (degree != np.array(old_degree))
+        | np.isnan(old_pagerank)
+        | ~np.isclose(rank, np.nan_to_num(old_pagerank), rtol=1e-3, atol=0)
+    )
+
+    updated = 0
+    version = None
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        for start in range(0, len(changed), CENTRALITY_WRITE_BATCH):
+            chunk = changed[start:start + CENTRALITY_WRITE_BATCH]
+            execute_values(cur, """
+                UPDATE graph_nodes AS n
+                SET degree = v.degree, pagerank = v.pagerank, pagerank_updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, degree, pagerank)
+                WHERE n.id = v.id::uuid
+            """, [(ids[i], int(degree[i]), float(rank[i])) for i in chunk],
+                page_size=CENTRALITY_WRITE_BATCH)
+            conn.commit()
+            updated += len(chunk)
+            progress['nodes_updated'] = updated
+
+        if updated:
+            version = bump_graph_version(cur)
+            conn.commit()
+        cur.close()
+    if version is not None:
+        mark_graph_changed(version)
+
+    return {'nodes': n, 'edges': len(src), 'iterations': iterations, 'nodes_updated': updated}
+
+def start_centrality_refresh(options=None):
+    """Start a centrality job unless one is already running; returns the job"""
+    global _centrality_job
+    options = options or {}
+    with _centrality_lock:
+        if _centrality_job is not None and _centrality_job['status'] == 'running':
+            return _centrality_job
+        _centrality_job = start_background_job(
+            'centrality', compute_centrality,
+            float(options.get('damping', CENTRALITY_DAMPING)),
+            int(options.get('max_iter', 100)),
+            float(options.get('tol', 1e-6))
+        )
+        return _centrality_job
+
+def schedule_centrality_refresh():
+    """Refresh centrality CENTRALITY_REFRESH_DELAY seconds after an ingest.
+
+    Ingests arriving while a refresh is pending share it, so bursts of
+    writes cost one recomputation.
+    """
+    global _centrality_timer
+    if CENTRALITY_REFRESH_DELAY <= 0:
+        return
+
+    def fire():
+        global _centrality_timer
+        with _centrality_lock:
+            _centrality_timer = None
+        start_centrality_refresh()
+
+    with _centrality_lock:
+        if _centrality_timer is None:
+            _centrality_timer = threading.Timer(CENTRALITY_REFRESH_DELAY, fire)
+            _centrality_timer.daemon = True
+            _centrality_timer.start()
+
+def symmetric_csr(n, src, dst, weights):
+    """Undirected CSR adjacency (indptr, indices, data) with parallel edges summed"""
+    rows = np.concatenate([src, dst])
+    cols = np.concatenate([dst, src])
+    keys, inverse = np.unique(rows * n + cols, return_inverse=True)
+    data = np.bincount(inverse, weights=np.concatenate([weights, weights]))
+    rows, indices = keys // n, keys % n
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, indices, data
+
+def louvain_level(indptr, indices, data, resolution=1.0, max_passes=10):
+    """Louvain local-moving phase: move nodes to the neighbouring community
+    with the best modularity gain until no node moves. Returns a community
+    label (0..C-1) per node.
+    """
+    n = len(indptr) - 1
+    k = np.bincount(np.repeat(np.arange(n), np.diff(indptr)), weights=data, minlength=n)
+    m2 = k.sum()
+    if m2 == 0:
+        return np.arange(n)
+
+    # Plain lists: far faster than numpy scalars in the per-node loop
+    indptr, indices, data, k = indptr.tolist(), indices.tolist(), data.tolist(), k.tolist()
+    community = list(range(n))
+    total = list(k)
+    order = np.random.default_rng(0).permutation(n).tolist()
+
+    for _ in range(max_passes):
+        moved = 0
+        for i in order:
+            current, ki = community[i], k[i]
+            links = {}
+            for p in range(indptr[i], indptr[i + 1]):
+                j = indices[p]
+                if j != i:
+                    links[community[j]] = links.get(community[j], 0.0) + data[p]
+
+            total[current] -= ki
+            best = current
+            best_gain = links.get(current, 0.0) - resolution * total[current] * ki / m2
+            for c, w in links.items():
+                gain = w - resolution * total[c] * ki / m2
+                if gain > best_gain:
+                    best, best_gain = c, gain
+            total[best] += ki
+            if best != current:
+                community[i] = best
+                moved += 1
+        if not moved:
+            break
+
+    return np.unique(community, return_inverse=True)[1]
+
+def detect_communities(n, src, dst, weights, resolution=1.0, max_levels=5):
+    """Hierarchical Louvain over an edge list.
+
+    Each level runs the local-moving phase on the graph of the previous
+    level's communities. Returns one array per level mapping every node
+    to its community, finest level first, and one array per level
+    mapping its communities to their parent at the next level (None for
+    the top level).
+    """
+    steps = []
+    size = n
+    for _ in range(max_levels):
+        labels = louvain_level(*symmetric_csr(size, src, dst, weights), resolution=resolution)
+        count = int(labels.max()) + 1 if size else 0
+        if count == size:
+            break
+        steps.append(labels)
+        src, dst, size = labels[src], labels[dst], count
+
+    levels = []
+    membership = np.arange(n)
+    for labels in steps:
+        membership = labels[membership]
+        levels.append(membership)
+    parents = steps[1:] + [None]
+    return levels, parents
+
+def delete_community_generations(conn, cur, keep):
+    """Delete every community generation except ``keep`` in committed batches"""
+    deleted = 0
+    for table, key in (('graph_node_communities', 'node_id, level'),
+                       ('graph_communities', 'level, community_id')):
+        while True:
+            cur.execute(f"""
+                DELETE FROM {table}
+                WHERE (generation, {key}) IN (
+                    SELECT generation, {key} FROM {table}
+                    WHERE generation <> %s
+                    LIMIT %s
+                )
+            """, (keep, INGEST_PAGE_SIZE * 10))
+            conn.commit()
+            if not cur.rowcount:
+                break
+            deleted += cur.rowcount
+    return deleted
+
+def build_communities(progress, resolution=COMMUNITY_RESOLUTION, min_size=COMMUNITY_MIN_SIZE,
+                      max_levels=COMMUNITY_MAX_LEVELS):
+    """Detect communities and replace the stored hierarchy.
+
+    The new hierarchy is written under a fresh generation in committed
+    batches, along with each community's centroid embedding (mean of
+    its members'), its most central entities, its entity type mix and a
+    one-line summary. Readers only see graph_meta.community_generation,
+    which is flipped in a small transaction once everything is written;
+    the old generation is then deleted in batches. Communities smaller
+    than ``min_size`` are dropped.
+    """
+    ids, _, src, dst, weights = load_graph_arrays()
+    progress.update({'nodes': len(ids), 'edges': len(src)})
+
+    levels, parents = detect_communities(len(ids), src, dst, weights, resolution, max_levels)
+    progress['levels'] = len(levels)
+
+    communities = []
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT community_generation FROM graph_meta WHERE id = 1")
+            active = cur.fetchone()[0]
+            conn.commit()
+            # Leftovers of an interrupted build
+            delete_community_generations(conn, cur, active)
+            generation = active + 1
+
+            written = 0
+            for level, (membership, parent) in enumerate(zip(levels, parents)):
+                sizes = np.bincount(membership)
+                kept = [
+                    (generation, level, int(c), int(parent[c]) if parent is not None else None, int(sizes[c]))
+                    for c in np.flatnonzero(sizes >= min_size)
+                ]
+                for start in range(0, len(kept), INGEST_PAGE_SIZE * 10):
+                    execute_values(cur, """
+                        INSERT INTO graph_communities (generation, level, community_id, parent_id, size)
+                        VALUES %s
+                    """, kept[start:start + INGEST_PAGE_SIZE * 10], page_size=INGEST_PAGE_SIZE)
+                    conn.commit()
+                communities.extend(kept)
+
+                # Nodes deleted since the graph was loaded are skipped by the join
+                members = np.flatnonzero(sizes[membership] >= min_size)
+                for start in range(0, len(members), INGEST_PAGE_SIZE * 10):
+                    chunk = members[start:start + INGEST_PAGE_SIZE * 10]
+                    execute_values(cur, """
+                        INSERT INTO graph_node_communities (generation, node_id, level, community_id)
+                        SELECT v.generation, v.node_id, v.level, v.community_id
+                        FROM (VALUES %s) AS v(generation, node_id, level, community_id)
+                        JOIN graph_nodes n ON n.id = v.node_id
+                    """, [
+                        (generation, ids[i], level, int(membership[i])) for i in chunk
+                    ], template='(%s, %s::uuid, %s, %s)', page_size=INGEST_PAGE_SIZE)
+                    conn.commit()
+                    written += len(chunk)
+                    progress['memberships_written'] = written
+
+                cur.execute("""
+                    UPDATE graph_communities c
+                    SET centroid = a.centroid
+                    FROM (
+                        SELECT m.community_id, AVG(n.embedding) AS centroid
+                        FROM graph_node_communities m
+                        JOIN graph_nodes n ON n.id = m.node_id
+                        WHERE m.generation = %(generation)s AND m.level = %(level)s
+                          AND n.embedding IS NOT NULL
+                        GROUP BY m.community_id
+                    ) a
+                    WHERE c.generation = %(generation)s AND c.level = %(level)s
+                      AND c.community_id = a.community_id
+                """, {'generation': generation, 'level': level})
+                cur.execute("""
+                    UPDATE graph_communities c
+                    SET top_entities = t.top_entities,
+                        entity_types = y.entity_types,
+                        summary = format('%%s entities, mostly %%s. Key entities: %%s.',
+                                         c.size, y.main_types, t.names)
+                    FROM (
+                        SELECT community_id,
+                               jsonb_agg(jsonb_build_object('entity', entity_name, 'type', entity_type)
+                                         ORDER BY rn) AS top_entities,
+                               string_agg(entity_name, ', ' ORDER BY rn) AS names
+                        FROM (
+                            SELECT m.community_id, n.entity_name, n.entity_type,
+                                   ROW_NUMBER() OVER (
+                                       PARTITION BY m.community_id
+                                       ORDER BY n.pagerank DESC NULLS LAST, n.degree DESC, n.entity_name
+                                   ) AS rn
+                            FROM graph_node_communities m
+                            JOIN graph_nodes n ON n.id = m.node_id
+                            WHERE m.generation = %(generation)s AND m.level = %(level)s
+                        ) ranked
+                        WHERE rn <= %(top)s
+                        GROUP BY community_id
+                    ) t
+                    JOIN (
+                        SELECT community_id,
+                               jsonb_object_agg(entity_type, members) AS entity_types,
+                               array_to_string((array_agg(entity_type ORDER BY members DESC))[1:3], ', ') AS main_types
+                        FROM (
+                            SELECT m.community_id,
+                                   COALESCE(n.entity_type, 'Unknown') AS entity_type, COUNT(*) AS members
+                            FROM graph_node_communities m
+                            JOIN graph_nodes n ON n.id = m.node_id
+                            WHERE m.generation = %(generation)s AND m.level = %(level)s
+                            GROUP BY 1, 2
+                        ) counts
+                        GROUP BY community_id
+                    ) y ON y.community_id = t.community_id
+                    WHERE c.generation = %(generation)s AND c.level = %(level)s
+                      AND c.community_id = t.community_id
+                """, {'generation': generation, 'level': level, 'top': COMMUNITY_TOP_ENTITIES})
+                conn.commit()
+            progress['communities'] = len(communities)
+
+            cur.execute(
+                "UPDATE graph_meta SET community_generation = %s WHERE id = 1",
+                (generation,)
+            )
+            version = bump_graph_version(cur)
+            conn.commit()
+            mark_graph_changed(version)
+            progress['generation'] = generation
+
+            progress['old_rows_deleted'] = delete_community_generations(conn, cur, generation)
+        finally:
+            conn.rollback()
+            cur.close()
+
+    return {
+        'nodes': len(ids),
+        'edges': len(src),
+        'generation': generation,
+        'levels': [
+            {'level': level, 'communities': sum(1 for c in communities if c[1] == level)}
+            for level in range(len(levels))
+        ]
+    }
+
+def start_community_detection(options=None):
+    """Start a community detection job unless one is already running"""
+    global _community_job
+    options = options or {}
+    with _community_lock:
+        if _community_job is not None and _community_job['status'] == 'running':
+            return _community_job
+        _community_job = start_background_job(
+            'communities', build_communities,
+            float(options.get('resolution', COMMUNITY_RESOLUTION)),
+            int(options.get('min_size', COMMUNITY_MIN_SIZE)),
+            int(options.get('max_levels', COMMUNITY_MAX_LEVELS))
+        )
+        return _community_job
+
+def find_similar_entities(progress, threshold, k=10, batch_size=200,
+                          max_nodes=None, search_options=None):
+    """Near-duplicate candidates by embedding similarity.
+
+    Walks graph_nodes in id order, batch_size nodes per query, and looks
+    up each node's k nearest neighbours through the ANN index (never all
+    pairs). Neighbours of the same entity_type with cosine similarity of
+    at least ``threshold`` become candidate pairs, which are grouped with
+    union-find. The earliest created node of a group is its keeper.
+    Grouping is transitive, so keep the threshold high.
+    """
+    parent = {}
+    info = {}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    pairs = {}
+    after = None
+    scanned = 0
+    progress.update({'nodes_scanned': 0, 'candidate_pairs': 0})
+
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        while max_nodes is None or scanned < max_nodes:
+            limit = batch_size if max_nodes is None else min(batch_size, max_nodes - scanned)
+            apply_vector_search_options(cur, search_options or {})
+            cur.execute("""
+                WITH seeds AS (
+                    SELECT id, entity_name, entity_type, created_at, embedding
+                    FROM graph_nodes
+                    WHERE embedding IS NOT NULL
+                      AND (%(after)s::uuid IS NULL OR id > %(after)s::uuid)
+                    ORDER BY id
+                    LIMIT %(limit)s
+                )
+                SELECT s.id, s.entity_name, s.created_at,
+                       c.id, c.entity_name, c.created_at, c.similarity
+                FROM seeds s
+                LEFT JOIN LATERAL (
+                    SELECT n.id, n.entity_name, n.entity_type, n.created_at,
+                           1 - (n.embedding <=> s.embedding) AS similarity
+                    FROM graph_nodes n
+                    WHERE n.embedding IS NOT NULL
+                      AND n.id <> s.id
+                      AND n.entity_type IS NOT DISTINCT FROM s.entity_type
+                    ORDER BY n.embedding <=> s.embedding
+                    LIMIT %(k)s
+                ) c ON c.similarity >= %(threshold)s
+                ORDER BY s.id
+            """, {'after': after, 'limit': limit, 'k': k, 'threshold': threshold})
+            rows = cur.fetchall()
+            conn.rollback()
+            if not rows:
+                break
+
+            seen = set()
+            for sid, sname, screated, cid, cname, ccreated, similarity in rows:
+                seen.add(sid)
+                after = sid
+                if cid is None:
+                    continue
+                for node_id, name, created in ((sid, sname, screated), (cid, cname, ccreated)):
+                    if node_id not in parent:
+                        parent[node_id] = node_id
+                        info[node_id] = (name, created)
+                key = (min(sid, cid), max(sid, cid))
+                pairs[key] = max(pairs.get(key, 0.0), float(similarity))
+                ra, rb = find(sid), find(cid)
+                if ra != rb:
+                    parent[ra] = rb
+
+            scanned += len(seen)
+            progress.update({'nodes_scanned': scanned, 'candidate_pairs': len(pairs)})
+            if len(seen) < limit:
+                break
+        cur.close()
+
+    groups = {}
+    for node_id in parent:
+        groups.setdefault(find(node_id), []).append(node_id)
+
+    result = []
+    for members in groups.values():
+        keeper = min(members, key=lambda m: (info[m][1], m))
+        result.append({
+            'keeper': {'id': keeper, 'entity': info[keeper][0]},
+            'members': [
+                {
+                    'id': m,
+                    'entity': info[m][0],
+                    'similarity': pairs.get((min(m, keeper), max(m, keeper)))
+                }
+                for m in members if m != keeper
+            ]
+        })
+    result.sort(key=lambda g: -len(g['members']))
+    return result
+
+def resolve_entities(progress, options):
+    """Entity-resolution job: find similar entities and optionally merge them"""
+    groups = find_similar_entities(
+        progress,
+        threshold=float(options.get('threshold', 0.92)),
+        k=int(options.get('k', 10)),
+        batch_size=int(options.get('batch_size', 200)),
+        max_nodes=int(options['max_nodes']) if options.get('max_nodes') else None,
+        search_options=options
+    )
+    result = {
+        'groups_found': len(groups),
+        'entities_to_merge': sum(len(g['members']) for g in groups)
+    }
+    if options.get('mode', 'review') == 'merge':
+        pairs = [(m['id'], g['keeper']['id']) for g in groups for m in g['members']]
+        merge_progress = {}
+        progress['merge'] = merge_progress
+        result.update(merge_duplicate_nodes(
+            merge_progress,
+            int(options.get('merge_batch_size', DEDUP_BATCH_SIZE)),
+            options.get('edge_weight', 'sum'),
+            pairs
+        ))
+    result['groups'] = groups[:int(options.get('max_groups', 1000))]
+    return result
+
+def encode_cursor(created_at, node_id):
+    """Opaque keyset cursor for /graph/visualize pages"""
+    raw = json.dumps([created_at.isoformat(), str(node_id)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        created_at, node_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return created_at, str(uuid.UUID(node_id))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def visualize_options(args):
+    """Parse and validate /graph/visualize query parameters"""
+    mode = args.get('mode', 'page')
+    if mode not in ('page', 'ego', 'top', 'types'):
+        raise ValueError("mode must be 'page', 'ego', 'top' or 'types'")
+    options = {
+        'mode': mode,
+        'limit': max(1, min(int(args.get('limit', VISUALIZE_PAGE_SIZE)), VISUALIZE_MAX_PAGE_SIZE)),
+        'cursor': decode_cursor(args['cursor']) if args.get('cursor') else None,
+        'rank_by': args.get('rank_by', 'degree'),
+        'hops': max(0, min(int(args.get('hops', 2)), MAX_EXPAND_HOPS)),
+        'max_fanout': int(args.get('max_fanout', 20)),
+        'node_id': str(uuid.UUID(args['node_id'])) if args.get('node_id') else None,
+        'entity': args.get('entity')
+    }
+    if options['rank_by'] not in ('degree', 'pagerank'):
+        raise ValueError("rank_by must be 'degree' or 'pagerank'")
+    if mode == 'ego' and not (options['node_id'] or options['entity']):
+        raise ValueError("ego mode needs node_id or entity")
+    return options
+
+def visualize_node(row):
+    return {
+        'kind': 'node',
+        'id': str(row[0]),
+        'label': row[1],
+        'type': row[2] or 'Unknown',
+        'description': row[3] or ''
+    }
+
+def visualize_edge(row):
+    return {
+        'kind': 'edge',
+        'source': str(row[0]),
+        'target': str(row[1]),
+        'label': row[2],
+        'weight': float(row[3]) if row[3] else 1.0
+    }
+
+def edges_among(cur, node_ids):
+    """Edges with both endpoints in ``node_ids``"""
+    snap = graph_snapshot
+    cached = snap.edges_among(node_ids) if snap is not None else None
+    if cached is not None:
+        for row in cached:
+            yield visualize_edge(row)
+        return
+
+    cur.execute("""
+        SELECT source_node_id, target_node_id, relationship_type, weight
+        FROM graph_edges
+        WHERE source_node_id = ANY(%(ids)s::uuid[])
+          AND target_node_id = ANY(%(ids)s::uuid[])
+    """, {'ids': list(node_ids)})
+    for row in cur.fetchall():
+        yield visualize_edge(row)
+
+def visualize_page(conn, cur, options):
+    """One keyset page of nodes (newest first) plus their edges.
+
+    An edge is sent with the page holding whichever endpoint sorts last,
+    so walking every page yields each edge exactly once and never one
+    whose endpoints haven't been sent yet.
+    """
+    cursor = options['cursor']
+    cur.execute("""
+        SELECT id, entity_name, entity_type, description, created_at
+        FROM graph_nodes
+        WHERE %(after_ts)s::timestamp IS NULL
+           OR (created_at, id) < (%(after_ts)s::timestamp, %(after_id)s::uuid)
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s
+    """, {
+        'after_ts': cursor[0] if cursor else None,
+        'after_id': cursor[1] if cursor else None,
+        'limit': options['limit']
+    })
+    rows = cur.fetchall()
+    for row in rows:
+        yield visualize_node(row)
+
+    if rows:
+        ids = [r[0] for r in rows]
+        # Named cursor: hub-heavy pages are streamed from the server
+        edge_cur = conn.cursor(name=f'visualize_{uuid.uuid4().hex}')
+        edge_cur.itersize = 2000
+        edge_cur.execute("""
+            SELECT e.source_node_id, e.target_node_id, e.relationship_type, e.weight
+            FROM graph_nodes p
+            JOIN graph_edges e ON e.source_node_id = p.id
+            JOIN graph_nodes t ON t.id = e.target_node_id
+            WHERE p.id = ANY(%(ids)s::uuid[])
+              AND (t.created_at, t.id) >= (p.created_at, p.id)
+            UNION ALL
+            SELECT e.source_node_id, e.target_node_id, e.relationship_type, e.weight
+            FROM graph_nodes p
+            JOIN graph_edges e ON e.target_node_id = p.id
+            JOIN graph_nodes s ON s.id = e.source_node_id
+            WHERE p.id = ANY(%(ids)s::uuid[])
+              AND (s.created_at, s.id) > (p.created_at, p.id)
+        """, {'ids': ids})
+        for row in edge_cur:
+            yield visualize_edge(row)
+        edge_cur.close()
+
+    last = rows[-1] if len(rows) == options['limit'] else None
+    yield {'kind': 'meta', 'next_cursor': encode_cursor(last[4], last[0]) if last else None}
+
+def visualize_ego(conn, cur, options):
+    """Subgraph within ``hops`` of one node"""
+    seed = options['node_id']
+    if not seed:
+        cur.execute("SELECT id FROM graph_nodes WHERE entity_name = %s", (options['entity'],))
+        row = cur.fetchone()
+        if row is None:
+            raise LookupError(f"Entity not found: {options['entity']}")
+        seed = row[0]
+
+    nodes = expand_graph(
+        cur, [seed], hops=options['hops'], max_fanout=options['max_fanout'],
+        max_nodes=options['limit']
+    )
+    for n in nodes:
+        yield {
+            'kind': 'node',
+            'id': n['id'],
+            'label': n['entity'],
+            'type': n['type'] or 'Unknown',
+            'description': n['description'] or '',
+            'depth': n['depth']
+        }
+    yield from edges_among(cur, [n['id'] for n in nodes])
+    yield {'kind': 'meta', 'center': str(seed), 'next_cursor': None}
+
+def visualize_top(conn, cur, options):
+    """The ``limit`` most central nodes and the edges between them.
+
+    Ranked by the degree or PageRank stored by compute_centrality.
+    """
+    column = 'pagerank' if options['rank_by'] == 'pagerank' else 'degree'
+    cur.execute(f"""
+        SELECT id, entity_name, entity_type, description, degree, pagerank
+        FROM graph_nodes
+        ORDER BY {column} DESC NULLS LAST
+        LIMIT %s
+    """, (options['limit'],))
+    rows = cur.fetchall()
+    for row in rows:
+        yield {**visualize_node(row), 'degree': row[4], 'pagerank': row[5]}
+    yield from edges_among(cur, [r[0] for r in rows])
+    yield {'kind': 'meta', 'next_cursor': None}
+
+def visualize_types(conn, cur, options):
+    """Zoomed-out view: one node per entity_type, edges summed between types"""
+    cur.execute("""
+        SELECT COALESCE(entity_type, 'Unknown'), COUNT(*)
+        FROM graph_nodes
+        GROUP BY 1
+        ORDER BY 2 DESC
+    """)
+    for typ, count in cur.fetchall():
+        yield {
+            'kind': 'node',
+            'id': f'type:{typ}',
+            'label': typ,
+            'type': typ,
+            'description': f'{count} entities',
+            'count': count,
+            'aggregate': True
+        }
+    cur.execute("""
+        SELECT COALESCE(s.entity_type, 'Unknown'), COALESCE(t.entity_type, 'Unknown'),
+               COUNT(*), SUM(COALESCE(e.weight, 1.0))
+        FROM graph_edges e
+        JOIN graph_nodes s ON s.id = e.source_node_id
+        JOIN graph_nodes t ON t.id = e.target_node_id
+        GROUP BY 1, 2
+    """)
+    for source_type, target_type, count, weight in cur.fetchall():
+        yield {
+            'kind': 'edge',
+            'source': f'type:{source_type}',
+            'target': f'type:{target_type}',
+            'label': f'{count} edges',
+            'weight': float(weight),
+            'count': count
+        }
+    yield {'kind': 'meta', 'next_cursor': None}
 
-def get_embedding(text: str):
-    """Generate embedding for text using local model"""
-    try:
-        model = init_embedder()
-        if model is None:
-            return None
-        
-        # Clean text
-        text = text.replace("\n", " ").strip()
-        if not text:
-            return None
-        
-        # Generate embedding (returns 384-dimensional vector)
-        embedding = model.encode(text, show_progress_bar=False)
-        return embedding.tolist()
-    except Exception as e:
-        print(f"Embedding error: {e}")
-        return None
+VISUALIZE_MODES = {
+    'page': visualize_page,
+    'ego': visualize_ego,
+    'top': visualize_top,
+    'types': visualize_types
+}
+
+def visualize_records(options):
+    """Yield node, edge and finally meta records for a visualize request"""
+    with get_db_connection() as conn:
+        cur = conn.cursor()
+        yield from VISUALIZE_MODES[options['mode']](conn, cur, options)
+        cur.close()
 
 @app.route('/health', methods=['GET'])
 def health():
     try:
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
-        cur.execute('SELECT COUNT(*) FROM graph_nodes')
-        nodes = cur.fetchone()[0]
-        cur.execute('SELECT COUNT(*) FROM graph_edges')
-        edges = cur.fetchone()[0]
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT COUNT(*) FROM graph_nodes')
+            nodes = cur.fetchone()[0]
+            cur.execute('SELECT COUNT(*) FROM graph_edges')
+            edges = cur.fetchone()[0]
         
-        # Check how many nodes have embeddings
-        cur.execute('SELECT COUNT(*) FROM graph_nodes WHERE embedding IS NOT NULL')
-        nodes_with_embeddings = cur.fetchone()[0]
+            # Check how many nodes have embeddings
+            cur.execute('SELECT COUNT(*) FROM graph_nodes WHERE embedding IS NOT NULL')
+            nodes_with_embeddings = cur.fetchone()[0]
         
-        cur.close()
-        conn.close()
+            cur.close()
         
         return jsonify({
             'status': 'ok', 
@@ -78,116 +2845,147 @@ def health():
             'edges': edges,
             'nodes_with_embeddings': nodes_with_embeddings,
             'embeddings_enabled': EMBEDDINGS_AVAILABLE,
-            'embedding_model': 'all-MiniLM-L6-v2 (384d)'
+            'embedding_model': f'{EMBEDDING_MODEL} (384d)',
+            'embedding_backend': EMBEDDING_BACKEND_ACTIVE or EMBEDDING_BACKEND,
+            'db_pool': get_db_pool_stats(),
+            'query_cache': get_query_cache_stats(),
+            'result_cache': get_result_cache_stats(),
+            'graph_snapshot': graph_snapshot.stats() if graph_snapshot is not None else None
         })
     except Exception as e:
-        return jsonify({'status': 'error', 'msg': str(e)}), 500
+        return jsonify({'status': 'error', 'msg': str(e), 'db_pool': get_db_pool_stats()}), 500
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 only once the model is warm and the DB answers.
+
+    With EMBEDDING_WARMUP disabled the model loads on first use, so only
+    the database is checked.
+    """
+    checks = {'model_warm': MODEL_WARM, 'db': False}
+    try:
+        with get_db_connection():
+            checks['db'] = True
+    except Exception as e:
+        checks['db_error'] = str(e)
+
+    model_ok = checks['model_warm'] or not EMBEDDING_WARMUP
+    status = 200 if model_ok and checks['db'] else 503
+    return jsonify({'ready': status == 200, **checks}), status
 
 @app.route('/graph/search', methods=['POST'])
+@cached_result('search')
 def search():
     try:
         data = request.json
         query = data.get('query', '')
+        limit = data.get('limit', 3)
         
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT id, entity_name, entity_type, description
-            FROM graph_nodes
-            WHERE entity_name ILIKE %s OR description ILIKE %s
-            LIMIT 3
-        """, (f'%{query}%', f'%{query}%'))
+        with get_db_connection() as conn:
+            cur = conn.cursor()
         
-        results = []
-        for eid, name, typ, desc in cur.fetchall():
-            cur.execute("""
-                SELECT n.entity_name, n.entity_type, e.relationship_type
-                FROM graph_edges e
-                JOIN graph_nodes n ON n.id = e.target_node_id
-                WHERE e.source_node_id = %s
-            """, (eid,))
+            centrality_weight = float(data.get('centrality_weight', 0))
+            hits = keyword_search(
+                cur, query, data.get('candidates', limit * 4) if centrality_weight else limit,
+                prefix=data.get('prefix', True),
+                match=data.get('match', 'all')
+            )
             
-            connections = [
-                {'name': c[0], 'type': c[1], 'rel': c[2]}
-                for c in cur.fetchall()
-            ]
+            # Optionally let central (hub) entities outrank peripheral ones
+            scores = {h[0]: float(h[4]) for h in hits}
+            pagerank = centrality_boost(cur, scores, centrality_weight, data.get('include_pagerank'))
+            if centrality_weight:
+                hits = sorted(hits, key=lambda h: scores[h[0]], reverse=True)[:limit]
             
-            results.append({
-                'entity': name,
-                'type': typ,
-                'description': desc,
-                'connections': connections
-            })
+            max_per_node, order = connection_options(data)
+            connections = fetch_connections(
+                cur, [h[0] for h in hits], max_per_node, order
+            )
         
-        cur.close()
-        conn.close()
+            results = []
+            for eid, name, typ, desc, rank in hits:
+                results.append({
+                    'entity': name,
+                    'type': typ,
+                    'description': desc,
+                    'rank': float(rank),
+                    'pagerank': pagerank.get(eid),
+                    'connections': connections[eid]
+                })
+        
+            cur.close()
         return jsonify({'results': results})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def claim_batch_key(cur, batch_key):
+    """Record a batch-insert Idempotency-Key in the current transaction.
+
+    Returns the stored response when a batch with this key was already
+    committed, otherwise None. A concurrent request with the same key
+    waits on the row until the first one commits or rolls back.
+    """
+    if not batch_key:
+        return None
+    cur.execute("""
+        INSERT INTO ingest_batches (batch_key) VALUES (%s)
+        ON CONFLICT (batch_key) DO NOTHING
+    """, (batch_key,))
+    if cur.rowcount:
+        return None
+    cur.execute("SELECT result FROM ingest_batches WHERE batch_key = %s", (batch_key,))
+    row = cur.fetchone()
+    return (row[0] if row else None) or {}
+
+def record_batch_key(cur, batch_key, result):
+    """Store the response for a claimed key and forget expired keys"""
+    if not batch_key:
+        return
+    cur.execute(
+        "UPDATE ingest_batches SET result = %s::jsonb WHERE batch_key = %s",
+        (json.dumps(result), batch_key)
+    )
+    cur.execute(
+        "DELETE FROM ingest_batches WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'",
+        (INGEST_BATCH_KEY_TTL,)
+    )
+
 @app.route('/graph/batch-insert', methods=['POST'])
 def batch_insert():
     try:
         data = request.json
         entities = data.get('entities', [])
         relationships = data.get('relationships', [])
+        batch_key = request.headers.get('Idempotency-Key')
 
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
+        with get_db_connection() as conn:
+            cur = conn.cursor()
 
-        entity_ids = {}
-        for entity in entities:
-            cur.execute("""
-                INSERT INTO graph_nodes (entity_name, entity_type, description)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (entity_name) DO UPDATE
-                SET description = COALESCE(EXCLUDED.description, graph_nodes.description)
-                RETURNING id, entity_name
-            """, (entity['name'], entity.get('type'), entity.get('description')))
-
-            result = cur.fetchone()
-            entity_ids[result[1]] = result[0]
-
-        edges_created = 0
-        for rel in relationships:
-            source = rel['source']
-            target = rel['target']
-
-            if source not in entity_ids:
-                cur.execute("SELECT id FROM graph_nodes WHERE entity_name = %s", (source,))
-                r = cur.fetchone()
-                if r:
-                    entity_ids[source] = r[0]
-
-            if target not in entity_ids:
-                cur.execute("SELECT id FROM graph_nodes WHERE entity_name = %s", (target,))
-                r = cur.fetchone()
-                if r:
-                    entity_ids[target] = r[0]
-
-            if source in entity_ids and target in entity_ids:
-                cur.execute("""
-                    INSERT INTO graph_edges (source_node_id, target_node_id, relationship_type, weight)
-                    SELECT %s, %s, %s, %s
-                    WHERE NOT EXISTS (
-                        SELECT 1 FROM graph_edges 
-                        WHERE source_node_id = %s AND target_node_id = %s
-                    )
-                """, (entity_ids[source], entity_ids[target], 
-                     rel.get('type', 'related_to'), rel.get('weight', 1.0),
-                     entity_ids[source], entity_ids[target]))
-                edges_created += cur.rowcount
+            applied = claim_batch_key(cur, batch_key)
+            if applied is not None:
+                conn.rollback()
+                cur.close()
+                return jsonify({**applied, 'duplicate': True})
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            entity_ids = upsert_nodes(cur, entities)
+            edges_created, edges_updated = insert_edges(cur, relationships, entity_ids)
+            result = {
+                'status': 'success',
+                'entities_processed': len(entities),
+                'edges_created': edges_created,
+                'edges_updated': edges_updated
+            }
+            record_batch_key(cur, batch_key, result)
 
-        return jsonify({
-            'status': 'success',
-            'entities_processed': len(entities),
-            'edges_created': edges_created
-        })
+            version = bump_graph_version(cur)
+            conn.commit()
+            cur.close()
+            notify_embedding_worker(conn)
+        mark_graph_changed(version)
+        if relationships:
+            schedule_centrality_refresh()
+
+        return jsonify(result)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -199,86 +2997,51 @@ def batch_insert_with_embeddings():
         data = request.json
         entities = data.get('entities', [])
         relationships = data.get('relationships', [])
+        batch_key = request.headers.get('Idempotency-Key')
         
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
+        # Generate embeddings from entity name + type + description in batches
+        embeddings = get_embeddings([
+            embedding_text(entity['name'], entity.get('type'), entity.get('description'))
+            for entity in entities
+        ], batch_size=data.get('batch_size'))
+        embeddings_created = sum(1 for e in embeddings if e)
         
-        entity_ids = {}
-        embeddings_created = 0
+        with get_db_connection() as conn:
+            cur = conn.cursor()
         
-        for entity in entities:
-            # Generate embedding from entity name + description
-            text_for_embedding = f"{entity['name']} {entity.get('type', '')} {entity.get('description', '')}"
-            embedding = get_embedding(text_for_embedding)
-            
-            if embedding:
-                cur.execute("""
-                    INSERT INTO graph_nodes (entity_name, entity_type, description, embedding)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (entity_name) DO UPDATE
-                    SET description = COALESCE(EXCLUDED.description, graph_nodes.description),
-                        embedding = EXCLUDED.embedding
-                    RETURNING id, entity_name
-                """, (entity['name'], entity.get('type'), entity.get('description'), embedding))
-                embeddings_created += 1
-            else:
-                cur.execute("""
-                    INSERT INTO graph_nodes (entity_name, entity_type, description)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (entity_name) DO UPDATE
-                    SET description = COALESCE(EXCLUDED.description, graph_nodes.description)
-                    RETURNING id, entity_name
-                """, (entity['name'], entity.get('type'), entity.get('description')))
-            
-            result = cur.fetchone()
-            entity_ids[result[1]] = result[0]
-        
-        # Insert relationships
-        edges_created = 0
-        for rel in relationships:
-            source = rel['source']
-            target = rel['target']
-            
-            if source not in entity_ids:
-                cur.execute("SELECT id FROM graph_nodes WHERE entity_name = %s", (source,))
-                r = cur.fetchone()
-                if r:
-                    entity_ids[source] = r[0]
-            
-            if target not in entity_ids:
-                cur.execute("SELECT id FROM graph_nodes WHERE entity_name = %s", (target,))
-                r = cur.fetchone()
-                if r:
-                    entity_ids[target] = r[0]
-            
-            if source in entity_ids and target in entity_ids:
-                cur.execute("""
-                    INSERT INTO graph_edges (source_node_id, target_node_id, relationship_type, weight)
-                    SELECT %s, %s, %s, %s
-                    WHERE NOT EXISTS (
-                        SELECT 1 FROM graph_edges 
-                        WHERE source_node_id = %s AND target_node_id = %s
-                    )
-                """, (entity_ids[source], entity_ids[target], 
-                     rel.get('type', 'related_to'), rel.get('weight', 1.0),
-                     entity_ids[source], entity_ids[target]))
-                edges_created += cur.rowcount
+            applied = claim_batch_key(cur, batch_key)
+            if applied is not None:
+                conn.rollback()
+                cur.close()
+                return jsonify({**applied, 'duplicate': True})
         
-        conn.commit()
-        cur.close()
-        conn.close()
+            entity_ids = upsert_nodes(cur, entities, embeddings)
+            edges_created, edges_updated = insert_edges(cur, relationships, entity_ids)
+            result = {
+                'status': 'success',
+                'entities_processed': len(entities),
+                'embeddings_created': embeddings_created,
+                'edges_created': edges_created,
+                'edges_updated': edges_updated
+            }
+            record_batch_key(cur, batch_key, result)
         
-        return jsonify({
-            'status': 'success',
-            'entities_processed': len(entities),
-            'embeddings_created': embeddings_created,
-            'edges_created': edges_created
-        })
+            version = bump_graph_version(cur)
+            conn.commit()
+            cur.close()
+            if embeddings_created < len(entities):
+                notify_embedding_worker(conn)
+        mark_graph_changed(version)
+        if relationships:
+            schedule_centrality_refresh()
+        
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/graph/semantic-search', methods=['POST'])
+@cached_result('semantic-search')
 def semantic_search():
     """Search using vector similarity + graph traversal"""
     try:
@@ -287,91 +3050,390 @@ def semantic_search():
         limit = data.get('limit', 5)
         
         # Generate query embedding
-        query_embedding = get_embedding(query)
+        query_embedding = get_query_embedding(query)
         if not query_embedding:
             return jsonify({'error': 'Failed to generate embedding'}), 500
         
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            apply_vector_search_options(cur, data)
         
-        # Vector similarity search
-        cur.execute("""
-            SELECT 
-                id,
-                entity_name,
-                entity_type,
-                description,
-                1 - (embedding <=> %s::vector) as similarity
-            FROM graph_nodes
-            WHERE embedding IS NOT NULL
-            ORDER BY embedding <=> %s::vector
-            LIMIT %s
-        """, (query_embedding, query_embedding, limit))
+            # Vector similarity search, over extra candidates when re-ranking by centrality
+            centrality_weight = float(data.get('centrality_weight', 0))
+            hits = vector_search(
+                cur, query_embedding,
+                data.get('candidates', limit * 4) if centrality_weight else limit
+            )
+            scores = {h[0]: float(h[4]) for h in hits}
+            pagerank = centrality_boost(cur, scores, centrality_weight, data.get('include_pagerank'))
+            if centrality_weight:
+                hits = sorted(hits, key=lambda h: scores[h[0]], reverse=True)[:limit]
         
-        results = []
-        for node_id, name, typ, desc, similarity in cur.fetchall():
-            # Get graph connections
-            cur.execute("""
-                SELECT n.entity_name, n.entity_type, e.relationship_type
-                FROM graph_edges e
-                JOIN graph_nodes n ON n.id = e.target_node_id
-                WHERE e.source_node_id = %s
-            """, (node_id,))
-            
-            connections = [
-                {'name': c[0], 'type': c[1], 'rel': c[2]}
-                for c in cur.fetchall()
+            # Get graph connections for all hits at once
+            max_per_node, order = connection_options(data)
+            connections = fetch_connections(
+                cur, [h[0] for h in hits], max_per_node, order
+            )
+        
+            results = []
+            for node_id, name, typ, desc, similarity in hits:
+                results.append({
+                    'entity': name,
+                    'type': typ,
+                    'description': desc,
+                    'similarity': float(similarity),
+                    'score': scores[node_id],
+                    'pagerank': pagerank.get(node_id),
+                    'connections': connections[node_id]
+                })
+        
+            # Optional multi-hop context around the hits
+            expansion = None
+            if data.get('hops'):
+                expansion = expand_graph(cur, [h[0] for h in hits], **expand_options(data))
+        
+            # Optional context ranked by a random walk with restart from the hits
+            context = None
+            if data.get('retrieval') == 'ppr' and hits:
+                context, context_stats = personalized_pagerank(
+                    cur, {h[0]: float(h[4]) for h in hits}, **ppr_options(data)
+                )
+        
+            cur.close()
+        
+        response = {'results': results}
+        if expansion is not None:
+            response['expansion'] = expansion
+        if context is not None:
+            response['context'] = context
+            response['context_stats'] = context_stats
+        return jsonify(response)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/graph/semantic-search/batch', methods=['POST'])
+@cached_result('semantic-search-batch')
+def semantic_search_batch():
+    """Vector search for many queries: one model call, one lookup, shared neighbours"""
+    try:
+        data = request.json
+        queries = data.get('queries')
+        limit = data.get('limit', 5)
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'error': 'queries must be a non-empty list'}), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({'error': f'At most {MAX_BATCH_QUERIES} queries per request'}), 400
+        queries = [str(q or '') for q in queries]
+        
+        # Encode every uncached query in one batch
+        embeddings = get_query_embeddings(queries)
+        embedded = [i for i, e in enumerate(embeddings) if e]
+        
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            apply_vector_search_options(cur, data)
+        
+            centrality_weight = float(data.get('centrality_weight', 0))
+            hits = [[] for _ in queries]
+            found = vector_search_many(
+                cur, [embeddings[i] for i in embedded],
+                data.get('candidates', limit * 4) if centrality_weight else limit
+            )
+            for i, rows in zip(embedded, found):
+                hits[i] = rows
+        
+            # Neighbours and PageRank are looked up once per distinct entity
+            nodes = {}
+            for rows in hits:
+                for node_id, name, typ, desc, _ in rows:
+                    nodes[node_id] = (name, typ, desc)
+            pagerank = centrality_boost(
+                cur, dict.fromkeys(nodes, 0.0), 0, centrality_weight or data.get('include_pagerank')
+            )
+            best = max(pagerank.values(), default=0) or 1.0
+            scores = [
+                {h[0]: float(h[4]) + centrality_weight * pagerank.get(h[0], 0.0) / best for h in rows}
+                for rows in hits
             ]
-            
+            if centrality_weight:
+                hits = [sorted(rows, key=lambda h: score[h[0]], reverse=True)[:limit]
+                        for rows, score in zip(hits, scores)]
+                nodes = {h[0]: nodes[h[0]] for rows in hits for h in rows}
+        
+            max_per_node, order = connection_options(data)
+            connections = fetch_connections(cur, list(nodes), max_per_node, order)
+        
+            cur.close()
+        
+        # Shared entities are listed once unless the caller wants them inline
+        dedupe = data.get('dedupe', True)
+        results = []
+        for query, rows, score, embedding in zip(queries, hits, scores, embeddings):
+            matches = []
+            for node_id, name, typ, desc, similarity in rows:
+                match = {'entity': name, 'similarity': float(similarity), 'score': score[node_id]}
+                if not dedupe:
+                    match.update({
+                        'type': typ,
+                        'description': desc,
+                        'pagerank': pagerank.get(node_id),
+                        'connections': connections[node_id]
+                    })
+                matches.append(match)
+            entry = {'query': query, 'results': matches}
+            if not embedding:
+                entry['error'] = 'Failed to generate embedding'
+            results.append(entry)
+        
+        response = {'results': results}
+        if dedupe:
+            response['entities'] = {
+                name: {
+                    'type': typ,
+                    'description': desc,
+                    'pagerank': pagerank.get(node_id),
+                    'connections': connections[node_id]
+                }
+                for node_id, (name, typ, desc) in nodes.items()
+            }
+        return jsonify(response)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/graph/hybrid-search', methods=['POST'])
+@cached_result('hybrid-search')
+def hybrid_search():
+    """Vector + keyword search fused into one ranking, optionally graph-boosted"""
+    try:
+        data = request.json
+        query = data.get('query', '')
+        limit = data.get('limit', 5)
+        candidates = data.get('candidates', limit * 4)
+        method = data.get('fusion', 'rrf')
+        weights = {
+            'vector': data.get('vector_weight', 1.0),
+            'keyword': data.get('keyword_weight', 1.0)
+        }
+        graph_boost = data.get('graph_boost', 0.0)
+        
+        # Run both candidate generators concurrently
+        vector_future = search_executor.submit(_vector_candidates, query, candidates, data)
+        keyword_future = search_executor.submit(_keyword_candidates, query, candidates, data)
+        vector_rows = vector_future.result()
+        keyword_rows = keyword_future.result()
+        
+        nodes = {}
+        sources = {}
+        for rank, (node_id, name, typ, desc, similarity) in enumerate(vector_rows, start=1):
+            nodes[node_id] = (name, typ, desc)
+            sources.setdefault(node_id, {})['vector'] = {'rank': rank, 'similarity': float(similarity)}
+        for rank, (node_id, name, typ, desc, score) in enumerate(keyword_rows, start=1):
+            nodes[node_id] = (name, typ, desc)
+            sources.setdefault(node_id, {})['keyword'] = {'rank': rank, 'score': float(score)}
+        
+        scores = fuse_rankings({
+            'vector': [(r[0], float(r[4])) for r in vector_rows],
+            'keyword': [(r[0], float(r[4])) for r in keyword_rows]
+        }, weights, method, data.get('rrf_k', 60))
+        
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+        
+            # Boost candidates that sit close to the strongest hits in the graph
+            distances = {}
+            if graph_boost and scores:
+                seeds = sorted(scores, key=scores.get, reverse=True)[:data.get('graph_seeds', 3)]
+                reached = expand_graph(
+                    cur, seeds,
+                    hops=max(1, min(int(data.get('graph_hops', 1)), MAX_EXPAND_HOPS)),
+                    direction='both',
+                    max_nodes=len(scores) * 10
+                )
+                distances = {n['id']: n['depth'] for n in reached if n['depth'] > 0}
+                for node_id, depth in distances.items():
+                    if node_id in scores:
+                        scores[node_id] += graph_boost / depth
+        
+            # Central entities get a boost of up to centrality_weight
+            pagerank = centrality_boost(
+                cur, scores, float(data.get('centrality_weight', 0)), data.get('include_pagerank')
+            )
+        
+            ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+        
+            max_per_node, order = connection_options(data)
+            connections = fetch_connections(cur, ranked, max_per_node, order)
+        
+            cur.close()
+        
+        results = []
+        for node_id in ranked:
+            name, typ, desc = nodes[node_id]
             results.append({
                 'entity': name,
                 'type': typ,
                 'description': desc,
-                'similarity': float(similarity),
-                'connections': connections
+                'score': scores[node_id],
+                'sources': sources[node_id],
+                'graph_distance': distances.get(node_id),
+                'pagerank': pagerank.get(node_id),
+                'connections': connections[node_id]
             })
         
-        cur.close()
-        conn.close()
-        
         return jsonify({'results': results})
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/graph/community-search', methods=['POST'])
+@cached_result('community-search')
+def community_search():
+    """Match a query against community centroids for global, theme-level questions"""
+    try:
+        data = request.json
+        query = data.get('query', '')
+        limit = data.get('limit', 5)
+        level = data.get('level')
+        
+        query_embedding = get_query_embedding(query)
+        if not query_embedding:
+            return jsonify({'error': 'Failed to generate embedding'}), 500
+        
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+        
+            # Default to the coarsest level: the graph's main themes
+            if level is None:
+                cur.execute("""
+                    SELECT MAX(level) FROM graph_communities
+                    WHERE generation = (SELECT community_generation FROM graph_meta WHERE id = 1)
+                """)
+                level = cur.fetchone()[0]
+        
+            results = []
+            if level is not None:
+                cur.execute("""
+                    SELECT community_id, parent_id, size, summary, top_entities, entity_types,
+                           1 - (centroid <=> %s::vector) AS similarity
+                    FROM graph_communities
+                    WHERE generation = (SELECT community_generation FROM graph_meta WHERE id = 1)
+                      AND level = %s AND centroid IS NOT NULL
+                    ORDER BY centroid <=> %s::vector
+                    LIMIT %s
+                """, (query_embedding, level, query_embedding, limit))
+                results = [
+                    {
+                        'community_id': community_id,
+                        'parent_id': parent_id,
+                        'size': size,
+                        'summary': summary,
+                        'top_entities': top_entities,
+                        'entity_types': entity_types,
+                        'similarity': float(similarity)
+                    }
+                    for community_id, parent_id, size, summary, top_entities, entity_types, similarity
+                    in cur.fetchall()
+                ]
+        
+            cur.close()
+        
+        return jsonify({'level': level, 'results': results})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/graph/expand', methods=['POST'])
+def expand():
+    """Multi-hop neighbourhood of seed entities"""
+    try:
+        data = request.json
+        entities = data.get('entities', [])
+        node_ids = list(data.get('node_ids', []))
+        options = expand_options(data)
+        
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+        
+            if entities:
+                cur.execute(
+                    "SELECT id FROM graph_nodes WHERE entity_name = ANY(%s)",
+                    (list(entities),)
+                )
+                node_ids.extend(r[0] for r in cur.fetchall())
+        
+            nodes = expand_graph(cur, node_ids, **options)
+        
+            cur.close()
+        
+        return jsonify({
+            'nodes': nodes,
+            'stats': {
+                'seed_count': len(node_ids),
+                'node_count': len(nodes),
+                'max_depth': max((n['depth'] for n in nodes), default=0)
+            }
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/graph/add-embeddings-to-existing', methods=['POST'])
 def add_embeddings_to_existing():
-    """Add embeddings to nodes that don't have them"""
+    """Embed nodes that have no embedding or a stale one"""
     try:
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
+        data = request.get_json(silent=True) or {}
+        limit = data.get('limit', 100)
+
+        with get_db_connection() as conn:
+            cur = conn.cursor()
         
-        # Get nodes without embeddings
-        cur.execute("""
-            SELECT id, entity_name, entity_type, description
-            FROM graph_nodes
-            WHERE embedding IS NULL
-            LIMIT 100
-        """)
+            # Nodes whose text or model changed since they were embedded
+            # (skipping rows an embedding worker is processing right now)
+            cur.execute("""
+                SELECT id, entity_name, entity_type, description, content_hash
+                FROM graph_nodes
+                WHERE embedding_hash IS DISTINCT FROM content_hash
+                   OR embedding_model IS DISTINCT FROM %s
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (EMBEDDING_MODEL, limit))
         
-        nodes = cur.fetchall()
-        embeddings_added = 0
+            nodes = cur.fetchall()
         
-        for node_id, name, typ, desc in nodes:
-            text = f"{name} {typ or ''} {desc or ''}"
-            embedding = get_embedding(text)
-            
-            if embedding:
-                cur.execute("""
-                    UPDATE graph_nodes
-                    SET embedding = %s
-                    WHERE id = %s
-                """, (embedding, node_id))
-                embeddings_added += 1
+            embeddings = get_embeddings([
+                embedding_text(name, typ, desc)
+                for _, name, typ, desc, _ in nodes
+            ], batch_size=data.get('batch_size'))
         
-        conn.commit()
-        cur.close()
-        conn.close()
+            updates = [
+                (node_id, embedding, text_hash, EMBEDDING_MODEL)
+                for (node_id, _, _, _, text_hash), embedding in zip(nodes, embeddings)
+                if embedding
+            ]
+            if updates:
+                execute_values(cur, """
+                    UPDATE graph_nodes AS n
+                    SET embedding = v.embedding::vector,
+                        embedding_hash = v.embedding_hash,
+                        embedding_model = v.embedding_model,
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM (VALUES %s) AS v(id, embedding, embedding_hash, embedding_model)
+                    WHERE n.id = v.id::uuid
+                """, updates, page_size=INGEST_PAGE_SIZE)
+            embeddings_added = len(updates)
+        
+            # Nothing written: keep cached results and the graph version
+            version = bump_graph_version(cur) if updates else None
+            conn.commit()
+            cur.close()
+        if version is not None:
+            mark_graph_changed(version)
         
         return jsonify({
             'status': 'success',
@@ -382,69 +3444,132 @@ def add_embeddings_to_existing():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/graph/visualize', methods=['GET'])
-def visualize():
-    """Get graph data for visualization"""
+@app.route('/graph/embeddings/stale', methods=['GET'])
+def stale_embeddings():
+    """Count nodes whose embedding is missing or out of date"""
     try:
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT id, entity_name, entity_type, description
-            FROM graph_nodes
-            ORDER BY created_at DESC
-            LIMIT 1000
-        """)
+        with get_db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT
+                    COUNT(*),
+                    COUNT(*) FILTER (WHERE embedding IS NULL),
+                    COUNT(*) FILTER (WHERE embedding IS NOT NULL
+                                       AND embedding_hash IS DISTINCT FROM content_hash),
+                    COUNT(*) FILTER (WHERE embedding IS NOT NULL
+                                       AND embedding_model IS DISTINCT FROM %s)
+                FROM graph_nodes
+            """, (EMBEDDING_MODEL,))
+            total, missing, content_changed, model_changed = cur.fetchone()
+            cur.close()
         
-        nodes = [
-            {
-                'id': str(row[0]),
-                'label': row[1],
-                'type': row[2] or 'Unknown',
-                'description': row[3] or ''
-            }
-            for row in cur.fetchall()
-        ]
+        return jsonify({
+            'nodes': total,
+            'missing': missing,
+            'content_changed': content_changed,
+            'model_changed': model_changed,
+            'current_model': EMBEDDING_MODEL
+        })
         
-        node_ids = [n['id'] for n in nodes]
-        if node_ids:
-            placeholders = ','.join(['%s'] * len(node_ids))
-            cur.execute(f"""
-                SELECT 
-                    e.source_node_id,
-                    e.target_node_id,
-                    e.relationship_type,
-                    e.weight
-                FROM graph_edges e
-                WHERE e.source_node_id IN ({placeholders})
-                   OR e.target_node_id IN ({placeholders})
-                LIMIT 2000
-            """, node_ids + node_ids)
-            
-            edges = [
-                {
-                    'source': str(row[0]),
-                    'target': str(row[1]),
-                    'label': row[2],
-                    'weight': float(row[3]) if row[3] else 1.0
-                }
-                for row in cur.fetchall()
-            ]
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/graph/vector-index', methods=['GET', 'POST'])
+def vector_index():
+    """Show (GET) or build/rebuild (POST) the ANN index on embeddings"""
+    try:
+        if request.method == 'GET':
+            with get_db_connection() as conn:
+                cur = conn.cursor()
+                status = get_vector_index_status(cur)
+                cur.close()
+            return jsonify(status)
+
+        data = request.get_json(silent=True) or {}
+        method = data.get('method', VECTOR_INDEX_METHOD)
+        rebuild = data.get('rebuild', False)
+
+        if method in ('ybhnsw', 'hnsw'):
+            options = f"m = {int(data.get('m', 16))}, ef_construction = {int(data.get('ef_construction', 64))}"
+        elif method == 'ivfflat':
+            options = f"lists = {int(data.get('lists', 100))}"
         else:
-            edges = []
-        
-        cur.close()
-        conn.close()
+            return jsonify({'error': f'Unsupported index method: {method}'}), 400
+
+        with get_db_connection() as conn:
+            # Index builds can't run inside a transaction block
+            conn.autocommit = True
+            try:
+                cur = conn.cursor()
+                existing = get_vector_index_status(cur)
+                if existing['exists'] and not rebuild:
+                    cur.close()
+                    return jsonify({'status': 'exists', **existing})
+
+                cur.execute(f"DROP INDEX IF EXISTS {VECTOR_INDEX_NAME}")
+                cur.execute(f"""
+                    CREATE INDEX {VECTOR_INDEX_NAME} ON graph_nodes
+                    USING {method} (embedding vector_cosine_ops)
+                    WITH ({options})
+                """)
+                status = get_vector_index_status(cur)
+                cur.close()
+            finally:
+                conn.autocommit = False
+
+        return jsonify({'status': 'rebuilt' if existing['exists'] else 'created', **status})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/graph/visualize', methods=['GET'])
+@cached_result('visualize')
+def visualize():
+    """Get graph data for visualization.
+
+    ``mode`` is 'page' (keyset pages via ``cursor``), 'ego' (``hops``
+    around ``node_id``/``entity``), 'top' (highest-degree nodes) or
+    'types' (aggregated per entity_type). ``format=ndjson`` streams one
+    record per line so clients can render progressively.
+    """
+    try:
+        options = visualize_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            try:
+                for record in visualize_records(options):
+                    yield json.dumps(record) + '\n'
+            except Exception as e:
+                yield json.dumps({'kind': 'error', 'error': str(e)}) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        nodes, edges, meta = [], [], {}
+        for record in visualize_records(options):
+            kind = record.pop('kind')
+            if kind == 'node':
+                nodes.append(record)
+            elif kind == 'edge':
+                edges.append(record)
+            else:
+                meta = record
         
         return jsonify({
             'nodes': nodes,
             'edges': edges,
+            'next_cursor': meta.get('next_cursor'),
             'stats': {
                 'node_count': len(nodes),
-                'edge_count': len(edges)
+                'edge_count': len(edges),
+                'mode': options['mode']
             }
         })
         
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -452,65 +3577,129 @@ def visualize():
 def deduplicate():
     """Find and merge duplicate entities"""
     try:
-        conn = psycopg2.connect(**DB)
-        cur = conn.cursor()
+        data = request.get_json(silent=True) or {}
+        batch_size = int(data.get('batch_size', DEDUP_BATCH_SIZE))
+        edge_weight = data.get('edge_weight', 'sum')
+        if edge_weight not in ('sum', 'max'):
+            return jsonify({'error': "edge_weight must be 'sum' or 'max'"}), 400
+        if batch_size <= 0:
+            return jsonify({'error': 'batch_size must be positive'}), 400
         
-        cur.execute("""
-            SELECT 
-                LOWER(entity_name) as name_lower,
-                id,
-                entity_name
-            FROM graph_nodes
-            ORDER BY LOWER(entity_name), created_at
-        """)
+        if data.get('async'):
+            job = start_background_job('deduplicate', merge_duplicate_nodes, batch_size, edge_weight)
+            return jsonify({'status': 'started', 'job_id': job['id']}), 202
         
-        rows = cur.fetchall()
-        merged = 0
-        duplicates = {}
-        
-        for name_lower, node_id, entity_name in rows:
-            if name_lower not in duplicates:
-                duplicates[name_lower] = []
-            duplicates[name_lower].append((node_id, entity_name))
-        
-        for name_lower, nodes in duplicates.items():
-            if len(nodes) > 1:
-                keep_id = nodes[0][0]
-                
-                for merge_id, merge_name in nodes[1:]:
-                    cur.execute("""
-                        UPDATE graph_edges 
-                        SET source_node_id = %s 
-                        WHERE source_node_id = %s
-                    """, (keep_id, merge_id))
-                    
-                    cur.execute("""
-                        UPDATE graph_edges 
-                        SET target_node_id = %s 
-                        WHERE target_node_id = %s
-                    """, (keep_id, merge_id))
-                    
-                    cur.execute("DELETE FROM graph_nodes WHERE id = %s", (merge_id,))
-                    merged += 1
-        
-        cur.execute("""
-            DELETE FROM graph_edges 
-            WHERE source_node_id = target_node_id
-        """)
-        self_refs = cur.rowcount
+        totals = merge_duplicate_nodes({}, batch_size, edge_weight)
+        return jsonify({'status': 'success', **totals})
         
-        conn.commit()
-        cur.close()
-        conn.close()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/graph/resolve-entities', methods=['POST'])
+def resolve_entities_route():
+    """Find (and optionally merge) near-duplicate entities by embedding similarity"""
+    try:
+        data = request.get_json(silent=True) or {}
+        if data.get('mode', 'review') not in ('review', 'merge'):
+            return jsonify({'error': "mode must be 'review' or 'merge'"}), 400
         
-        return jsonify({
-            'status': 'success',
-            'entities_merged': merged,
-            'self_references_removed': self_refs
-        })
+        if data.get('async'):
+            job = start_background_job('resolve-entities', resolve_entities, data)
+            return jsonify({'status': 'started', 'job_id': job['id']}), 202
+        
+        return jsonify({'status': 'success', **resolve_entities({}, data)})
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/graph/centrality', methods=['POST'])
+def centrality():
+    """Recompute node degree and PageRank"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        if data.get('async'):
+            job = start_centrality_refresh(data)
+            return jsonify({'status': 'started', 'job_id': job['id']}), 202
+        
+        result = compute_centrality(
+            {},
+            float(data.get('damping', CENTRALITY_DAMPING)),
+            int(data.get('max_iter', 100)),
+            float(data.get('tol', 1e-6))
+        )
+        return jsonify({'status': 'success', **result})
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/graph/communities', methods=['GET', 'POST'])
+def communities():
+    """Show (GET) or rebuild (POST) the community hierarchy"""
+    try:
+        if request.method == 'GET':
+            with get_db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("""
+                    SELECT level, COUNT(*), SUM(size), MAX(size), MAX(created_at)
+                    FROM graph_communities
+                    WHERE generation = (SELECT community_generation FROM graph_meta WHERE id = 1)
+                    GROUP BY level
+                    ORDER BY level
+                """)
+                levels = [
+                    {
+                        'level': level,
+                        'communities': count,
+                        'nodes': int(nodes),
+                        'largest': largest,
+                        'built_at': built_at.isoformat() if built_at else None
+                    }
+                    for level, count, nodes, largest, built_at in cur.fetchall()
+                ]
+                cur.close()
+            return jsonify({'levels': levels})
+
+        data = request.get_json(silent=True) or {}
+        if data.get('async'):
+            job = start_community_detection(data)
+            return jsonify({'status': 'started', 'job_id': job['id']}), 202
+
+        result = build_communities(
+            {},
+            float(data.get('resolution', COMMUNITY_RESOLUTION)),
+            int(data.get('min_size', COMMUNITY_MIN_SIZE)),
+            int(data.get('max_levels', COMMUNITY_MAX_LEVELS))
+        )
+        return jsonify({'status': 'success', **result})
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status and progress of a background job"""
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(dict(job, progress=dict(job['progress'])))
+
 if __name__ == '__main__':
+    # With the debug reloader only the child process serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        init_shared_cache()
+        start_warm_up()
+        start_graph_snapshot()
     app.run(host='0.0.0.0', port=5005, debug=True)
+else:
+    init_shared_cache()
+    start_warm_up()
+    start_graph_snapshot()
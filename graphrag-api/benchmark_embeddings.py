@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Compare embedding backends on this machine's CPU.
+
+Each backend is measured in its own subprocess so peak memory (RSS) is
+not skewed by models loaded earlier. Reports load time, encode
+throughput, peak memory and the lowest cosine similarity to the torch
+backend on the benchmark texts.
+
+    python benchmark_embeddings.py --backends torch,torch-int8,onnx,onnx-int8
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+def sample_texts(n):
+    """Entity-like texts of varying length"""
+    base = [
+        'YugabyteDB Database Distributed SQL database with PostgreSQL compatibility for global applications',
+        'Dify Platform LLM application development platform with workflow orchestration',
+        'GraphRAG Technology Graph-based Retrieval Augmented Generation combining knowledge graphs with LLMs',
+        'Python Language High-level programming language widely used in AI and data science',
+        'Redis Cache In-memory data structure store used for caching and message queuing',
+        'Docker Platform Containerization platform for deploying applications',
+    ]
+    return [f'{base[i % len(base)]} #{i}' for i in range(n)]
+
+def run_backend(backend, n, batch_size):
+    """Measure one backend in this process and print a JSON result"""
+    import embedding_models
+
+    started = time.perf_counter()
+    model = embedding_models.load_embedding_model(backend)
+    load_seconds = time.perf_counter() - started
+
+    texts = sample_texts(n)
+    model.encode(texts[:batch_size], batch_size=batch_size, show_progress_bar=False)  # warm-up
+
+    started = time.perf_counter()
+    vectors = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False)
+    encode_seconds = time.perf_counter() - started
+
+    single = time.perf_counter()
+    for text in texts[:50]:
+        model.encode(text, show_progress_bar=False)
+    single_ms = (time.perf_counter() - single) / 50 * 1000
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    # Parity against torch (loaded only after memory was measured)
+    parity = None
+    if backend != 'torch':
+        reference = embedding_models.load_embedding_model('torch')
+        parity = embedding_models.embedding_parity(model, reference, texts[:200] + embedding_models.PARITY_TEXTS)
+
+    print(json.dumps({
+        'backend': backend,
+        'load_seconds': round(load_seconds, 2),
+        'texts_per_second': round(len(texts) / encode_seconds, 1),
+        'single_query_ms': round(single_ms, 2),
+        'peak_rss_mb': round(peak_rss_mb, 1),
+        'dimensions': int(vectors.shape[1]),
+        'min_cosine_vs_torch': round(parity, 5) if parity is not None else None
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', default='torch,torch-int8,onnx,onnx-int8')
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        run_backend(args.backend, args.texts, args.batch_size)
+        return
+
+    print(f"{'backend':<12}{'load s':>8}{'texts/s':>10}{'1-query ms':>12}{'peak MB':>10}{'min cos':>10}")
+    for backend in args.backends.split(','):
+        proc = subprocess.run(
+            [sys.executable, __file__, '--backend', backend,
+             '--texts', str(args.texts), '--batch-size', str(args.batch_size)],
+            capture_output=True, text=True
+        )
+        lines = [l for l in proc.stdout.splitlines() if l.startswith('{')]
+        if proc.returncode != 0 or not lines:
+            print(f"{backend:<12} failed: {proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'no output'}")
+            continue
+        r = json.loads(lines[-1])
+        parity = '-' if r['min_cosine_vs_torch'] is None else f"{r['min_cosine_vs_torch']:.4f}"
+        print(f"{backend:<12}{r['load_seconds']:>8}{r['texts_per_second']:>10}{r['single_query_ms']:>12}{r['peak_rss_mb']:>10}{parity:>10}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+os.environ.setdefault('EMBEDDING_WARMUP', 'false')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'shared'))
+
+app = pytest.importorskip('app')
+
+
+class FakeCursor:
+    """Answers the node details query personalized_pagerank() makes"""
+
+    def __init__(self, names):
+        self.names = names
+        self.rows = []
+
+    def execute(self, query, params):
+        self.rows = [(node_id, self.names[node_id], 'T', None) for node_id in params[0]]
+
+    def fetchall(self):
+        return self.rows
+
+
+def use_graph(monkeypatch, edges):
+    """Serve local_neighbourhood() from an undirected (source, target, weight) list"""
+    def neighbourhood(cur, frontier, max_fanout):
+        result = []
+        for node_id in frontier:
+            touching = [e for e in edges if node_id in e[:2]]
+            touching.sort(key=lambda e: e[2], reverse=True)
+            for source, target, weight in touching[:max_fanout]:
+                nbr = target if source == node_id else source
+                result.append((nbr, (source, target, 'rel'), weight))
+        return result
+    monkeypatch.setattr(app, 'local_neighbourhood', neighbourhood)
+
+
+def test_isolated_seeds(monkeypatch):
+    use_graph(monkeypatch, [])
+    context, stats = app.personalized_pagerank(FakeCursor({}), {'a': 0.9, 'b': 0.5})
+    assert context == []
+    assert stats['subgraph_nodes'] == 2
+    assert stats['subgraph_edges'] == 0
+    assert stats['converged']
+
+
+def test_matches_dense_reference(monkeypatch):
+    edges = [('s', 'a', 1.0), ('a', 'b', 2.0), ('b', 'c', 1.0), ('s', 'd', 0.5), ('d', 'c', 1.0)]
+    use_graph(monkeypatch, edges)
+    names = {node_id: node_id.upper() for node_id in 'sabcd'}
+    restart = 0.15
+    context, stats = app.personalized_pagerank(
+        FakeCursor(names), {'s': 1.0}, restart=restart, hops=3, tol=1e-10, max_iter=1000,
+        time_budget_ms=10000
+    )
+    assert stats['converged']
+
+    # Dense random walk with restart on the same undirected graph
+    order = list('sabcd')
+    matrix = np.zeros((5, 5))
+    for source, target, weight in edges:
+        i, j = order.index(source), order.index(target)
+        matrix[i, j] += weight
+        matrix[j, i] += weight
+    transition = matrix / matrix.sum(axis=1, keepdims=True)
+    personalization = np.array([1.0, 0, 0, 0, 0])
+    rank = np.linalg.solve(np.eye(5) - (1 - restart) * transition.T, restart * personalization)
+
+    expected = sorted(range(1, 5), key=lambda i: -rank[i])
+    assert [c['entity'] for c in context] == [order[i].upper() for i in expected]
+    for c in context:
+        assert c['score'] == pytest.approx(rank[order.index(c['entity'].lower())], rel=1e-6)
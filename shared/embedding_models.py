@@ -0,0 +1,72 @@
+"""Embedding model loading shared by graphrag-api, embedding-service and
+embedding-worker.
+
+Each image copies this file next to its app (see the build's ``shared``
+context in docker-compose.yaml), so all three pick backends and check
+parity the same way and keep producing comparable vectors.
+"""
+import os
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+# Inference backend: torch, torch-int8, onnx or onnx-int8 (all CPU)
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+EMBEDDING_ONNX_FILE = os.getenv('EMBEDDING_ONNX_FILE', 'onnx/model_quint8_avx2.onnx')
+EMBEDDING_PARITY_CHECK = os.getenv('EMBEDDING_PARITY_CHECK', 'true').lower() in ('1', 'true', 'yes')
+EMBEDDING_PARITY_THRESHOLD = float(os.getenv('EMBEDDING_PARITY_THRESHOLD', '0.98'))
+PARITY_TEXTS = [
+    'YugabyteDB Database Distributed SQL database with PostgreSQL compatibility',
+    'Dify Platform LLM application development platform with workflow orchestration',
+    'GraphRAG Technology Graph-based Retrieval Augmented Generation',
+    'Redis Cache In-memory data structure store used for caching',
+    'what are the main themes in the knowledge graph?'
+]
+
+def load_embedding_model(backend):
+    """Load EMBEDDING_MODEL for CPU inference with the given backend.
+
+    'torch' is the fp32 PyTorch model, 'torch-int8' the same model with
+    dynamically quantized Linear layers, 'onnx' runs the exported model on
+    ONNX Runtime and 'onnx-int8' a pre-quantized ONNX file
+    (EMBEDDING_ONNX_FILE).
+    """
+    from sentence_transformers import SentenceTransformer
+    if backend == 'torch':
+        return SentenceTransformer(EMBEDDING_MODEL, device='cpu')
+    if backend == 'torch-int8':
+        import torch
+        model = SentenceTransformer(EMBEDDING_MODEL, device='cpu')
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == 'onnx':
+        return SentenceTransformer(EMBEDDING_MODEL, device='cpu', backend='onnx')
+    if backend == 'onnx-int8':
+        return SentenceTransformer(
+            EMBEDDING_MODEL, device='cpu', backend='onnx',
+            model_kwargs={'file_name': EMBEDDING_ONNX_FILE}
+        )
+    raise ValueError(f'Unknown embedding backend: {backend}')
+
+def embedding_parity(model, reference, texts=PARITY_TEXTS):
+    """Lowest cosine similarity between two models' embeddings of ``texts``"""
+    a = model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    b = reference.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    return float((a * b).sum(axis=1).min())
+
+def load_checked_model(backend=EMBEDDING_BACKEND):
+    """Load ``backend``, falling back to torch when it disagrees with it.
+
+    Stored vectors must stay comparable with ones made by the torch
+    model, so a non-torch backend is only kept if its embeddings of
+    PARITY_TEXTS are within EMBEDDING_PARITY_THRESHOLD of torch's.
+    Returns the model and the backend actually loaded.
+    """
+    print(f"Loading embedding model ({backend} backend)...")
+    model = load_embedding_model(backend)
+    if backend != 'torch' and EMBEDDING_PARITY_CHECK:
+        reference = load_embedding_model('torch')
+        parity = embedding_parity(model, reference)
+        print(f"Backend parity vs torch: min cosine {parity:.4f}")
+        if parity < EMBEDDING_PARITY_THRESHOLD:
+            print(f"Parity below {EMBEDDING_PARITY_THRESHOLD}, falling back to torch")
+            model, backend = reference, 'torch'
+        del reference
+    return model, backend
@@ -19,5 +19,12 @@ if [ $? -ne 0 ]; then
   /home/yugabyte/bin/ysqlsh -h /tmp/.yb.*:5433 --file=/home/yugabyte/init-db.sql
 fi
 
+# Bring existing databases up to date (migrations are idempotent)
+for migration in /home/yugabyte/migrations/*.sql; do
+  [ -e "$migration" ] || continue
+  echo "Applying $(basename "$migration")..."
+  /home/yugabyte/bin/ysqlsh -h /tmp/.yb.*:5433 -d graphrag --file="$migration"
+done
+
 # Don't exit this script so that the container continues to run YugabyteDB
 tail -f /dev/null
\ No newline at end of file
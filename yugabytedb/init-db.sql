@@ -8,8 +8,12 @@ CREATE DATABASE graphrag;
 CREATE EXTENSION vector;
 
 -- Drop existing tables if any
+DROP TABLE IF EXISTS graph_node_communities CASCADE;
+DROP TABLE IF EXISTS graph_communities CASCADE;
 DROP TABLE IF EXISTS graph_edges CASCADE;
 DROP TABLE IF EXISTS graph_nodes CASCADE;
+DROP TABLE IF EXISTS graph_meta CASCADE;
+DROP TABLE IF EXISTS ingest_batches CASCADE;
 
 -- Create graph_nodes table
 CREATE TABLE graph_nodes (
@@ -18,7 +22,24 @@ CREATE TABLE graph_nodes (
     entity_type TEXT,
     description TEXT,
     embedding vector(384),
+    -- md5 of the text embeddings are computed from; must match embedding_text() in graphrag-api
+    content_hash TEXT GENERATED ALWAYS AS (
+        md5(entity_name || ' ' || COALESCE(entity_type, '') || ' ' || COALESCE(description, ''))
+    ) STORED,
+    -- content_hash and model the current embedding was computed from
+    embedding_hash TEXT,
+    embedding_model TEXT,
+    -- edge count and weighted PageRank, refreshed by graphrag-api's centrality job
+    degree INT NOT NULL DEFAULT 0,
+    pagerank DOUBLE PRECISION,
+    -- set by the centrality job; kept apart from updated_at so PageRank
+    -- refreshes don't make the graph snapshot re-read whole nodes
+    pagerank_updated_at TIMESTAMP,
     properties JSONB DEFAULT '{}',
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', COALESCE(entity_name, '')), 'A') ||
+        setweight(to_tsvector('simple', COALESCE(description, '')), 'B')
+    ) STORED,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -31,16 +52,82 @@ CREATE TABLE graph_edges (
     relationship_type VARCHAR(100) NOT NULL,
     properties JSONB DEFAULT '{}',
     weight FLOAT DEFAULT 1.0,
+    -- how many times this relationship was ingested
+    mention_count INT NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Community hierarchy built by graphrag-api (POST /graph/communities);
+-- level 0 is the finest, parent_id points at the containing community one level up.
+-- Rebuilds write a new generation; graph_meta.community_generation is the live one.
+CREATE TABLE graph_communities (
+    generation INT NOT NULL,
+    level INT NOT NULL,
+    community_id INT NOT NULL,
+    parent_id INT,
+    size INT NOT NULL,
+    summary TEXT,
+    top_entities JSONB DEFAULT '[]',
+    entity_types JSONB DEFAULT '{}',
+    -- mean embedding of the members, matched by /graph/community-search
+    centroid vector(384),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (generation, level, community_id)
+);
+
+CREATE TABLE graph_node_communities (
+    generation INT NOT NULL,
+    node_id UUID NOT NULL REFERENCES graph_nodes(id) ON DELETE CASCADE,
+    level INT NOT NULL,
+    community_id INT NOT NULL,
+    PRIMARY KEY (generation, node_id, level)
+);
+
+-- Graph version counter, bumped by every write so API result caches can be invalidated
+CREATE TABLE graph_meta (
+    id INT PRIMARY KEY CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    -- generation of graph_communities served to readers
+    community_generation INT NOT NULL DEFAULT 0
+);
+INSERT INTO graph_meta (id, version) VALUES (1, 0);
+
+-- Idempotency-Key of applied batch-insert requests, so retried batches are not counted twice
+CREATE TABLE ingest_batches (
+    batch_key TEXT PRIMARY KEY,
+    result JSONB,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Create indexes for better performance
 CREATE INDEX idx_nodes_name ON graph_nodes(entity_name);
 CREATE INDEX idx_nodes_type ON graph_nodes(entity_type);
+CREATE INDEX idx_nodes_search ON graph_nodes USING gin (search_vector);
+-- Nodes that need (re-)embedding: no embedding yet or text changed since
+CREATE INDEX idx_nodes_stale_embedding ON graph_nodes(id)
+    WHERE embedding_hash IS DISTINCT FROM content_hash;
+-- Change feed for graphrag-api's in-memory graph snapshot
+CREATE INDEX idx_nodes_updated ON graph_nodes(updated_at ASC);
+CREATE INDEX idx_edges_updated ON graph_edges(updated_at ASC);
+CREATE INDEX idx_nodes_pagerank_updated ON graph_nodes(pagerank_updated_at ASC);
+-- Most central nodes first (visualize level-of-detail)
+CREATE INDEX idx_nodes_degree ON graph_nodes(degree DESC);
+CREATE INDEX idx_nodes_pagerank ON graph_nodes(pagerank DESC NULLS LAST);
+-- One edge per (source, target, relationship_type); inserts upsert with ON CONFLICT
+CREATE UNIQUE INDEX idx_edges_unique ON graph_edges(source_node_id, target_node_id, relationship_type);
 CREATE INDEX idx_edges_source ON graph_edges(source_node_id);
 CREATE INDEX idx_edges_target ON graph_edges(target_node_id);
 CREATE INDEX idx_edges_relationship ON graph_edges(relationship_type);
 
+CREATE INDEX idx_ingest_batches_created ON ingest_batches(created_at ASC);
+
+CREATE INDEX idx_node_communities_community ON graph_node_communities(generation, level, community_id);
+
+-- ANN index for cosine similarity search (rebuild via POST /graph/vector-index)
+CREATE INDEX NONCONCURRENTLY idx_nodes_embedding ON graph_nodes
+    USING ybhnsw (embedding vector_cosine_ops);
+
 -- Insert sample data
 /*
 INSERT INTO graph_nodes (entity_name, entity_type, description) VALUES
@@ -0,0 +1,10 @@
+-- Indexed full-text keyword search for /graph/search
+-- Safe to run more than once; new databases get this from init-db.sql.
+
+ALTER TABLE graph_nodes ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', COALESCE(entity_name, '')), 'A') ||
+        setweight(to_tsvector('simple', COALESCE(description, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_nodes_search ON graph_nodes USING gin (search_vector);
@@ -0,0 +1,10 @@
+-- Graph version counter used to invalidate graphrag-api result caches
+-- Safe to run more than once; new databases get this from init-db.sql.
+
+CREATE TABLE IF NOT EXISTS graph_meta (
+    id INT PRIMARY KEY CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO graph_meta (id, version) VALUES (1, 0)
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,21 @@
+-- Track which text and model each embedding was computed from so only
+-- changed nodes are re-embedded.
+-- Safe to run more than once; new databases get this from init-db.sql.
+
+ALTER TABLE graph_nodes ADD COLUMN IF NOT EXISTS content_hash TEXT
+    GENERATED ALWAYS AS (
+        md5(entity_name || ' ' || COALESCE(entity_type, '') || ' ' || COALESCE(description, ''))
+    ) STORED;
+ALTER TABLE graph_nodes ADD COLUMN IF NOT EXISTS embedding_hash TEXT;
+ALTER TABLE graph_nodes ADD COLUMN IF NOT EXISTS embedding_model TEXT;
+
+-- Existing embeddings are assumed to match their current text and to come
+-- from the only model used so far. To force a one-time full refresh
+-- instead, run: UPDATE graph_nodes SET embedding_hash = NULL;
+UPDATE graph_nodes
+SET embedding_hash = content_hash,
+    embedding_model = 'all-MiniLM-L6-v2'
+WHERE embedding IS NOT NULL AND embedding_model IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_nodes_stale_embedding ON graph_nodes(id)
+    WHERE embedding_hash IS DISTINCT FROM content_hash;
@@ -0,0 +1,42 @@
+-- One edge per (source, target, relationship_type) so graphrag-api can
+-- upsert edges with ON CONFLICT. Existing duplicates are collapsed into
+-- the oldest edge: weights are summed and counted as mentions.
+-- Safe to run more than once; new databases get this from init-db.sql.
+-- Once idx_edges_unique exists there can be no duplicates, so later runs
+-- skip the scan of graph_edges (and the cache invalidation).
+
+ALTER TABLE graph_edges ADD COLUMN IF NOT EXISTS mention_count INT NOT NULL DEFAULT 1;
+
+DO $$
+BEGIN
+    IF to_regclass('idx_edges_unique') IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    CREATE TEMP TABLE edge_duplicates AS
+    SELECT (array_agg(id ORDER BY created_at, id))[1] AS survivor,
+           array_agg(id) AS ids,
+           SUM(COALESCE(weight, 1.0)) AS weight,
+           SUM(mention_count) AS mention_count
+    FROM graph_edges
+    GROUP BY source_node_id, target_node_id, relationship_type
+    HAVING COUNT(*) > 1;
+
+    UPDATE graph_edges e
+    SET weight = d.weight,
+        mention_count = d.mention_count
+    FROM edge_duplicates d
+    WHERE e.id = d.survivor;
+
+    DELETE FROM graph_edges e
+    USING edge_duplicates d
+    WHERE e.id = ANY(d.ids) AND e.id <> d.survivor;
+
+    DROP TABLE edge_duplicates;
+
+    -- Drop cached search results that may include the removed edges
+    UPDATE graph_meta SET version = version + 1 WHERE id = 1;
+END $$;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_edges_unique
+    ON graph_edges(source_node_id, target_node_id, relationship_type);
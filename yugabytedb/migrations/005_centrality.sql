@@ -0,0 +1,10 @@
+-- Per-node degree and PageRank used as ranking signals by graphrag-api.
+-- Values are filled in by its centrality job (POST /graph/centrality, or
+-- automatically after ingests).
+-- Safe to run more than once; new databases get this from init-db.sql.
+
+ALTER TABLE graph_nodes ADD COLUMN IF NOT EXISTS degree INT NOT NULL DEFAULT 0;
+ALTER TABLE graph_nodes ADD COLUMN IF NOT EXISTS pagerank DOUBLE PRECISION;
+
+CREATE INDEX IF NOT EXISTS idx_nodes_degree ON graph_nodes(degree DESC);
+CREATE INDEX IF NOT EXISTS idx_nodes_pagerank ON graph_nodes(pagerank DESC NULLS LAST);
@@ -0,0 +1,26 @@
+-- Community hierarchy and centroids for /graph/community-search, filled
+-- in by graphrag-api (POST /graph/communities).
+-- Safe to run more than once; new databases get this from init-db.sql.
+
+CREATE TABLE IF NOT EXISTS graph_communities (
+    level INT NOT NULL,
+    community_id INT NOT NULL,
+    parent_id INT,
+    size INT NOT NULL,
+    summary TEXT,
+    top_entities JSONB DEFAULT '[]',
+    entity_types JSONB DEFAULT '{}',
+    centroid vector(384),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (level, community_id)
+);
+
+CREATE TABLE IF NOT EXISTS graph_node_communities (
+    node_id UUID NOT NULL REFERENCES graph_nodes(id) ON DELETE CASCADE,
+    level INT NOT NULL,
+    community_id INT NOT NULL,
+    PRIMARY KEY (node_id, level)
+);
+
+CREATE INDEX IF NOT EXISTS idx_node_communities_community
+    ON graph_node_communities(level, community_id);
@@ -0,0 +1,8 @@
+-- updated_at on edges plus range indexes on both tables, so graphrag-api's
+-- in-memory graph snapshot can pull only what changed since its last refresh.
+-- Safe to run more than once; new databases get this from init-db.sql.
+
+ALTER TABLE graph_edges ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_nodes_updated ON graph_nodes(updated_at ASC);
+CREATE INDEX IF NOT EXISTS idx_edges_updated ON graph_edges(updated_at ASC);
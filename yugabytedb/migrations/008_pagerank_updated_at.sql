@@ -0,0 +1,8 @@
+-- Separate change timestamp for PageRank. The centrality job sets it instead
+-- of updated_at, so graphrag-api's graph snapshot can refresh PageRank as
+-- (id, pagerank) pairs without re-reading names and embeddings.
+-- Safe to run more than once; new databases get this from init-db.sql.
+
+ALTER TABLE graph_nodes ADD COLUMN IF NOT EXISTS pagerank_updated_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_nodes_pagerank_updated ON graph_nodes(pagerank_updated_at ASC);
@@ -0,0 +1,43 @@
+-- Community hierarchy is written under a new generation and published by
+-- flipping graph_meta.community_generation, so a rebuild never needs one
+-- big transaction. Communities are derived data: tables from before this
+-- change are recreated and need a new POST /graph/communities.
+-- Safe to run more than once; new databases get this from init-db.sql.
+
+ALTER TABLE graph_meta ADD COLUMN IF NOT EXISTS community_generation INT NOT NULL DEFAULT 0;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'graph_communities' AND column_name = 'generation'
+    ) THEN
+        DROP TABLE IF EXISTS graph_node_communities;
+        DROP TABLE IF EXISTS graph_communities;
+    END IF;
+END $$;
+
+CREATE TABLE IF NOT EXISTS graph_communities (
+    generation INT NOT NULL,
+    level INT NOT NULL,
+    community_id INT NOT NULL,
+    parent_id INT,
+    size INT NOT NULL,
+    summary TEXT,
+    top_entities JSONB DEFAULT '[]',
+    entity_types JSONB DEFAULT '{}',
+    centroid vector(384),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (generation, level, community_id)
+);
+
+CREATE TABLE IF NOT EXISTS graph_node_communities (
+    generation INT NOT NULL,
+    node_id UUID NOT NULL REFERENCES graph_nodes(id) ON DELETE CASCADE,
+    level INT NOT NULL,
+    community_id INT NOT NULL,
+    PRIMARY KEY (generation, node_id, level)
+);
+
+CREATE INDEX IF NOT EXISTS idx_node_communities_community
+    ON graph_node_communities(generation, level, community_id);
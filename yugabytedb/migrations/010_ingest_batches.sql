@@ -0,0 +1,12 @@
+-- Idempotency-Key of applied batch-insert requests, so a retried batch is
+-- not counted twice (weights and mention counts). graphrag-api forgets
+-- keys after INGEST_BATCH_KEY_TTL hours.
+-- Safe to run more than once; new databases get this from init-db.sql.
+
+CREATE TABLE IF NOT EXISTS ingest_batches (
+    batch_key TEXT PRIMARY KEY,
+    result JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_batches_created ON ingest_batches(created_at ASC);